@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark convert_urls.py archive classification against a large synthetic Kiwix catalog.
+
+Results are written as JSON and can be compared with an earlier run via --compare.
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+import convert_urls
+
+PROJECTS = [
+    'wikipedia', 'wiktionary', 'wikibooks', 'wikivoyage', 'gutenberg', 'devdocs', 'ted', 'freecodecamp',
+    'php.net', 'archlinux', 'docs.python.org', 'medlineplus.gov', 'openstreetmap-wiki', 'termux',
+    'urban-prepper', 'citizendium.org', 'fas-military-medicine', 'quickguidesformedicine', 'libretexts.org',
+    'stackexchange', 'mathoverflow.net', 'khanacademy', 'phet', 'ifixit', 'wikihow'
+]
+LANGS = ['en', 'fr', 'de', 'es', 'it', 'pt', 'ru', 'zh', 'ja', 'ar', 'mul']
+FLAVOURS = [
+    'all', 'all_maxi', 'all_nopic', 'all_mini', 'wp1-0.8_nopic', 'medicine_maxi', 'life', 'ideas',
+    'project-euler', 'python', 'cpp', 'gnu-make', 'lcc-a', 'lcc-pn', 'top_maxi', 'human'
+]
+
+def content_ids(entries, seed):
+    rng = random.Random(seed)
+    for _ in range(entries):
+        project = rng.choice(PROJECTS)
+        if rng.random() < 0.2:
+            # Long tail of projects no rule knows about
+            project = f"{project}-{rng.randrange(5000)}"
+        yield (f"{project}_{rng.choice(LANGS)}_{rng.choice(FLAVOURS)}_"
+               f"{rng.randrange(2018, 2027)}-{rng.randrange(1, 13):02d}")
+
+def generate_catalog(path, entries, seed):
+    """Write a catalog in the format of Docker KiwiX URLs.txt"""
+    with open(path, 'w') as f:
+        f.write("Docker KiwiX URLs\n\n")
+        for content_id in content_ids(entries, seed):
+            f.write(f"URL: https://browse.library.kiwix.org/viewer#{content_id}\n\n")
+            f.write(f"DOWNLOAD: https://download.kiwix.org/zim/zimit/{content_id}.zim\n\n")
+
+def generate_opds_catalog(path, entries, seed):
+    """Write a catalog shaped like the Kiwix OPDS feed"""
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:dc="http://purl.org/dc/terms/" '
+                'xmlns:opds="https://specs.opds.io/opds-1.2">\n  <title>All zims</title>\n')
+        for number, content_id in enumerate(content_ids(entries, seed)):
+            project, lang = content_id.split('_')[:2]
+            f.write(f"""  <entry>
+    <id>urn:uuid:{number:08x}-0000-0000-0000-000000000000</id>
+    <title>{project.replace('-', ' ').title()}</title>
+    <summary>{' '.join(rng.choice(PROJECTS) for _ in range(12))}</summary>
+    <language>{lang}</language>
+    <name>{content_id.rsplit('_', 1)[0]}</name>
+    <articleCount>{rng.randrange(100, 6000000)}</articleCount>
+    <link type="text/html" href="/content/{content_id}" />
+    <link rel="http://opds-spec.org/acquisition/open-access" type="application/x-zim" length="{rng.randrange(10**6, 10**11)}"
+          href="https://download.kiwix.org/zim/{project}/{content_id}.zim.meta4" />
+  </entry>
+""")
+        f.write("</feed>\n")
+
+def best_of(repeat, func):
+    """Fastest of several runs, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def benchmark(args):
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'cpu_count': os.cpu_count(),
+        'entries': args.entries,
+        'seed': args.seed,
+        'stages': {}
+    }
+
+    with tempfile.TemporaryDirectory(prefix="classifier-bench-") as tmp:
+        catalog = Path(tmp) / "catalog.txt"
+        generate_catalog(catalog, args.entries, args.seed)
+        urls = convert_urls.VIEWER_URL.findall(catalog.read_text())
+        opds_catalog = Path(tmp) / "catalog.xml"
+        generate_opds_catalog(opds_catalog, args.entries, args.seed)
+
+        report['stages']['load_rules'] = best_of(args.repeat, lambda: convert_urls.load_classifier(args.rules))
+
+        def classify():
+            # A fresh classifier each run, so its project cache starts cold
+            classifier = convert_urls.load_classifier(args.rules)
+            for url in urls:
+                classifier.classify(url)
+
+        report['stages']['classify'] = best_of(args.repeat, classify)
+        report['stages']['convert'] = best_of(
+            args.repeat, lambda: convert_urls.convert_urls(str(catalog), Path(tmp) / "out.html",
+                                                           convert_urls.load_classifier(args.rules))
+        )
+        report['stages']['read_opds'] = best_of(
+            args.repeat, lambda: sum(1 for _ in convert_urls.read_opds_catalog(
+                str(opds_catalog), convert_urls.load_classifier(args.rules)))
+        )
+        report['opds_mb'] = opds_catalog.stat().st_size / (1024 * 1024)
+
+    for stage, seconds in report['stages'].items():
+        rate = f", {args.entries / seconds:,.0f} entries/sec" if stage != 'load_rules' else ''
+        print(f"{stage}: {seconds * 1000:.1f} ms{rate}")
+    return report
+
+def compare(report, baseline):
+    """Print per-stage speed changes against an earlier report"""
+    print(f"\nCompared with run from {baseline.get('started_at', 'unknown')}:")
+    if baseline.get('entries') != report['entries']:
+        print(f"  note: baseline used {baseline.get('entries')} entries")
+    for stage, seconds in report['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before:
+            print(f"  {stage}: no baseline")
+            continue
+        print(f"  {stage}: {before / seconds - 1:+.1%} speed")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=50000, help="catalog entries to generate")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage, the fastest is reported")
+    parser.add_argument('--rules', type=Path, default=convert_urls.DEFAULT_RULES, help="rule file to load")
+    parser.add_argument('--output', default=f"classifier-bench-{time.strftime('%Y%m%d-%H%M%S')}.json",
+                        help="where to write the JSON report")
+    parser.add_argument('--compare', help="earlier JSON report to compare against")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = benchmark(args)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
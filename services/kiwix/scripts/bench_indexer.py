@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Benchmark the archive indexer stages against synthetic corpora and an in-process Meilisearch stub.
+
+Each stage runs in its own process so peak RSS is measured per stage. Results are
+written as JSON and can be compared with an earlier run via --compare.
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+import index_content
+from meili_stub import MeiliStub
+
+STAGES = index_content.INDEX_STAGES
+
+WORDS = (
+    "water shelter fire first aid bandage wound splint fracture garden seed soil compost harvest "
+    "radio antenna battery solar panel filter boil purify map compass knot rope tarp stove fuel "
+    "canning pickle ferment grain bean potato tomato squash pest mulch irrigation rain barrel"
+).split()
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+def pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def write_pdf(path, pages):
+    """Write a minimal text-only PDF with one Helvetica text block per page"""
+    font_ref = 3 + 2 * len(pages)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(len(pages)))}] "
+        f"/Count {len(pages)} >>".encode()
+    ]
+    for i, text in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_ref} 0 R >> >> /Contents {4 + 2 * i} 0 R >>".encode()
+        )
+        lines = [text[j:j + 90] for j in range(0, len(text), 90)][:60]
+        stream = ("BT /F1 10 Tf 40 750 Td 12 TL " +
+                  ' '.join(f"({pdf_escape(line)}) '" for line in lines) + " ET").encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+def write_page(path, rng, words):
+    path.write_text(f"""<!DOCTYPE html>
+<html><head><title>{sentence(rng, 5).title()}</title>
+<meta name="description" content="{sentence(rng, 15)}">
+<style>body {{ font-family: sans-serif; }}</style>
+<script>var analytics = {rng.random()};</script></head>
+<body><nav><a href="/">Home</a> <a href="/about.html">About</a></nav>
+<h1>{sentence(rng, 6)}</h1>
+{''.join(f'<p>{sentence(rng, 60)}</p>' for _ in range(max(1, words // 60)))}
+<footer>Mirrored for offline use</footer></body></html>""", encoding='utf-8')
+
+def write_zim(path, rng, articles, words):
+    from libzim.writer import Creator, Hint, Item, StringProvider
+
+    class Article(Item):
+        def __init__(self, number):
+            super().__init__()
+            self.number = number
+            self.html = (f"<html><head><title>Article {number}</title></head>"
+                         f"<body><p>{sentence(rng, words)}</p></body></html>")
+
+        def get_path(self):
+            return f"A/article_{self.number}"
+
+        def get_title(self):
+            return f"Article {self.number}"
+
+        def get_mimetype(self):
+            return "text/html"
+
+        def get_contentprovider(self):
+            return StringProvider(self.html)
+
+        def get_hints(self):
+            return {Hint.FRONT_ARTICLE: True}
+
+    with Creator(str(path)).config_indexing(False, "eng") as creator:
+        creator.set_mainpath("A/article_0")
+        for number in range(articles):
+            creator.add_item(Article(number))
+        creator.add_metadata("Title", "Benchmark archive")
+        creator.add_metadata("Language", "eng")
+
+def generate_corpus(root, args):
+    """Create data/ and zims/ trees shaped like the indexer's mounts"""
+    rng = random.Random(args.seed)
+    data_dir = root / "data"
+    zim_dir = root / "zims"
+
+    categories = [collection['category'] for collection in index_content.DEFAULT_PDF_COLLECTIONS]
+    for number in range(args.pdfs):
+        category_dir = data_dir / categories[number % len(categories)]
+        category_dir.mkdir(parents=True, exist_ok=True)
+        write_pdf(category_dir / f"manual_{number}.pdf",
+                  [sentence(rng, args.page_words) for _ in range(args.pdf_pages)])
+
+    for number in range(args.html_files):
+        site_dir = data_dir / "mirrored_sites" / f"site{number % args.sites}"
+        page_dir = site_dir / f"section{number // 100}"
+        page_dir.mkdir(parents=True, exist_ok=True)
+        write_page(page_dir / f"page_{number}.html", rng, args.page_words)
+
+    if args.zim_articles and index_content.Archive is not None:
+        zim_dir.mkdir(parents=True, exist_ok=True)
+        write_zim(zim_dir / "benchmark.zim", rng, args.zim_articles, args.page_words)
+
+    return data_dir, zim_dir
+
+def count_files(data_dir, zim_dir, stage):
+    if stage == 'pdfs':
+        return sum(1 for collection in index_content.DEFAULT_PDF_COLLECTIONS
+                   for _ in (data_dir / collection['category']).glob("*.pdf"))
+    if stage == 'websites':
+        return sum(1 for _ in (data_dir / "mirrored_sites").rglob("*.html"))
+    if index_content.Archive is None or not zim_dir.exists():
+        return 0
+    return sum(index_content.Archive(path).entry_count for path in zim_dir.glob("*.zim"))
+
+def run_stage(stage, meili_url, data_dir, zim_dir, state_dir, options, results):
+    """Run one indexing stage in this (child) process and report its timings"""
+    indexer = index_content.ArchiveIndexer(meili_url, 'benchmark', state_dir, **options)
+    indexer.data_dir = data_dir
+    indexer.zim_dir = zim_dir
+    indexer.wait_until_ready()
+    indexer.create_indices()
+
+    started = time.perf_counter()
+    indexer.index_stage(stage)
+    seconds = time.perf_counter() - started
+
+    # ru_maxrss is in kilobytes on Linux
+    results.put({
+        'seconds': seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_worker_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        'stage_seconds': {
+            name: timing['seconds'] for name, timing in indexer.metrics.summary()['stages'].items()
+        }
+    })
+
+def benchmark(args):
+    options = {
+        'pdf_workers': args.pdf_workers,
+        'html_extractor': args.html_extractor,
+        'web_parse_workers': args.web_parse_workers,
+        'index_mode': args.index_mode,
+        'meili_max_connections': args.meili_max_connections
+    }
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'cpu_count': os.cpu_count(),
+        'corpus': {
+            'pdfs': args.pdfs,
+            'pdf_pages': args.pdf_pages,
+            'sites': args.sites,
+            'html_files': args.html_files,
+            'zim_articles': args.zim_articles,
+            'page_words': args.page_words,
+            'seed': args.seed
+        },
+        'task_delay': args.task_delay,
+        'options': options,
+        'stages': {}
+    }
+
+    with tempfile.TemporaryDirectory(prefix="indexer-bench-") as tmp:
+        root = Path(tmp)
+        started = time.perf_counter()
+        data_dir, zim_dir = generate_corpus(root, args)
+        print(f"Generated corpus in {time.perf_counter() - started:.1f}s")
+
+        context = multiprocessing.get_context('fork')
+        with MeiliStub(task_delay=args.task_delay) as stub:
+            for stage in args.stages:
+                files = count_files(data_dir, zim_dir, stage)
+                if not files:
+                    print(f"Skipping {stage}: nothing to index")
+                    continue
+
+                # A fresh process and state directory per stage, so every file is new
+                results = context.Queue()
+                process = context.Process(
+                    target=run_stage,
+                    args=(stage, stub.url, data_dir, zim_dir, root / f"state-{stage}", options, results)
+                )
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    print(f"Stage {stage} failed with exit code {process.exitcode}")
+                    continue
+
+                result = results.get()
+                result.update({
+                    'files': files,
+                    'files_per_sec': files / result['seconds'],
+                    'documents': sum(stub.document_count(uid) for uid in index_content.INDEX_SETTINGS)
+                })
+                report['stages'][stage] = result
+                stub.indexes.clear()
+                print(f"{stage}: {files} files in {result['seconds']:.2f}s "
+                      f"({result['files_per_sec']:.1f} files/sec), peak RSS {result['peak_rss_mb']:.0f} MB, "
+                      f"workers {result['peak_worker_rss_mb']:.0f} MB")
+
+    return report
+
+def compare(report, baseline):
+    """Print per-stage throughput and memory changes against an earlier report"""
+    print(f"\nCompared with run from {baseline.get('started_at', 'unknown')}:")
+    for stage, result in report['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before:
+            print(f"  {stage}: no baseline")
+            continue
+        speed = result['files_per_sec'] / before['files_per_sec'] - 1
+        memory = result['peak_rss_mb'] - before['peak_rss_mb']
+        print(f"  {stage}: {speed:+.1%} files/sec, {memory:+.0f} MB peak RSS")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pdfs', type=int, default=30, help="number of synthetic PDFs")
+    parser.add_argument('--pdf-pages', type=int, default=20, help="pages per PDF")
+    parser.add_argument('--sites', type=int, default=5, help="number of mirrored sites")
+    parser.add_argument('--html-files', type=int, default=2000, help="HTML files across all sites")
+    parser.add_argument('--zim-articles', type=int, default=2000, help="articles in the synthetic ZIM")
+    parser.add_argument('--page-words', type=int, default=300, help="words per PDF page, HTML page and article")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--stages', type=lambda value: value.split(','), default=STAGES,
+                        help=f"comma separated stages to run ({','.join(STAGES)})")
+    parser.add_argument('--pdf-workers', type=int, default=None)
+    parser.add_argument('--html-extractor', default='lxml', choices=list(index_content.HTML_EXTRACTORS))
+    parser.add_argument('--web-parse-workers', type=int, default=0)
+    parser.add_argument('--index-mode', default='threads', choices=index_content.INDEX_MODES)
+    parser.add_argument('--meili-max-connections', type=int, default=8)
+    parser.add_argument('--task-delay', type=float, default=0.0,
+                        help="seconds the Meilisearch stub takes to finish each task")
+    parser.add_argument('--output', default=f"indexer-bench-{time.strftime('%Y%m%d-%H%M%S')}.json",
+                        help="where to write the JSON report")
+    parser.add_argument('--compare', help="earlier JSON report to compare against")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = benchmark(args)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
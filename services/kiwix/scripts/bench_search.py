@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Load-test query latency of the documents and websites indices under different index settings.
+
+Every settings variant gets a fresh Meilisearch, either the in-process stub or a local
+meilisearch binary listening on 127.0.0.1, indexed by the real indexer from a synthetic
+corpus or --data-dir. The same queries, replayed from a log or generated from indexed
+titles, then run at a fixed concurrency. Nothing is sent over the network.
+"""
+
+import os
+import json
+import math
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import tomllib
+import subprocess
+import contextlib
+from pathlib import Path
+
+import aiohttp
+
+import index_content
+from bench_indexer import generate_corpus
+from meili_stub import MeiliStub
+
+INDEXES = ['documents', 'websites']
+MASTER_KEY = 'benchmark'
+# Titles sampled per index when queries are generated
+TITLE_SAMPLE = 1000
+
+def load_variants(path):
+    """Return [{'name', 'settings': {index: settings}}], index settings from create_indices by default"""
+    variants = [{'name': 'current'}]
+    if path:
+        with open(path, 'rb') as f:
+            variants = tomllib.load(f).get('variant') or variants
+
+    loaded = []
+    for variant in variants:
+        # A variant only lists the settings it changes
+        loaded.append({
+            'name': variant['name'],
+            'settings': {
+                index_uid: dict(index_content.INDEX_SETTINGS[index_uid], **variant.get(index_uid, {}))
+                for index_uid in INDEXES
+            }
+        })
+    return loaded
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@contextlib.contextmanager
+def local_meilisearch(binary, db_dir):
+    """Run a meilisearch binary on a loopback port with its own database and no telemetry"""
+    port = free_port()
+    with open(db_dir.with_suffix('.log'), 'w') as log:
+        process = subprocess.Popen(
+            [binary, '--db-path', str(db_dir), '--http-addr', f"127.0.0.1:{port}", '--master-key', MASTER_KEY,
+             '--env', 'development', '--no-analytics'],
+            stdout=log, stderr=subprocess.STDOUT
+        )
+        try:
+            yield f"http://127.0.0.1:{port}"
+        finally:
+            process.terminate()
+            process.wait()
+
+@contextlib.contextmanager
+def search_backend(args, root, name):
+    if args.meili_binary:
+        with local_meilisearch(args.meili_binary, root / f"meili-{name}") as url:
+            yield url
+    else:
+        with MeiliStub() as stub:
+            yield stub.url
+
+@contextlib.contextmanager
+def index_settings(settings):
+    """Have create_indices apply a variant's settings"""
+    original = index_content.INDEX_SETTINGS
+    index_content.INDEX_SETTINGS = dict(original, **settings)
+    try:
+        yield
+    finally:
+        index_content.INDEX_SETTINGS = original
+
+def build_indexes(url, data_dir, state_dir, settings, log):
+    """Index the corpus with the real indexer, returning seconds taken and Meilisearch stats"""
+    with index_settings(settings), contextlib.redirect_stdout(log):
+        indexer = index_content.ArchiveIndexer(url, MASTER_KEY, state_dir)
+        indexer.data_dir = data_dir
+        indexer.wait_until_ready()
+        indexer.create_indices()
+        started = time.perf_counter()
+        for index_uid in INDEXES:
+            indexer.index_stage(index_content.STAGE_OF_INDEX[index_uid])
+        seconds = time.perf_counter() - started
+    return seconds, indexer.client.get_all_stats()
+
+def load_query_log(path):
+    """Read queries as plain lines or JSON lines with q and optionally index and filter"""
+    queries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            query = json.loads(line) if line.startswith('{') else {'q': line}
+            for index_uid in [query['index']] if query.get('index') else INDEXES:
+                if index_uid in INDEXES:
+                    queries.append((index_uid, {key: query[key] for key in ('q', 'filter') if key in query}))
+    return queries
+
+def generate_queries(client, count, rng):
+    """Queries of one to three words from indexed titles, some cut off mid-word as if still being typed"""
+    titles = {}
+    for index_uid in INDEXES:
+        documents = client.index(index_uid).get_documents({'fields': ['title'], 'limit': TITLE_SAMPLE}).results
+        titles[index_uid] = [doc.title.lower().split() for doc in documents if getattr(doc, 'title', None)]
+
+    queries = []
+    candidates = [index_uid for index_uid in INDEXES if titles[index_uid]]
+    for _ in range(count if candidates else 0):
+        index_uid = rng.choice(candidates)
+        words = rng.choice(titles[index_uid])
+        length = rng.randint(1, min(3, len(words)))
+        start = rng.randint(0, len(words) - length)
+        terms = words[start:start + length]
+        if len(terms[-1]) > 3 and rng.random() < 0.3:
+            terms[-1] = terms[-1][:rng.randint(2, len(terms[-1]) - 1)]
+        queries.append((index_uid, {'q': ' '.join(terms)}))
+    return queries
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+async def replay(url, queries, concurrency, warmup):
+    """Send every query once from a fixed number of workers, returning latencies and errors per index"""
+    latencies = {index_uid: [] for index_uid in INDEXES}
+    errors = {index_uid: 0 for index_uid in INDEXES}
+    headers = {'Authorization': f"Bearer {MASTER_KEY}"}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(url, headers=headers, connector=connector) as session:
+        async def search(index_uid, query):
+            async with session.post(f"/indexes/{index_uid}/search", json=query) as response:
+                await response.read()
+                return response.status < 400
+
+        # Warm-up queries open the connections and caches without being measured
+        for index_uid, query in queries[:warmup]:
+            await search(index_uid, query)
+
+        pending = iter(queries)
+
+        async def worker():
+            for index_uid, query in pending:
+                started = time.perf_counter()
+                try:
+                    succeeded = await search(index_uid, query)
+                except aiohttp.ClientError:
+                    succeeded = False
+                if succeeded:
+                    latencies[index_uid].append(time.perf_counter() - started)
+                else:
+                    errors[index_uid] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+    return latencies, errors, seconds
+
+def summarize(latencies, errors, seconds):
+    """Latency percentiles in milliseconds and queries per second, per index and overall"""
+    summary = {}
+    for index_uid, values in dict(latencies, all=sum(latencies.values(), [])).items():
+        ordered = sorted(values)
+        failed = errors.get(index_uid, sum(errors.values()))
+        summary[index_uid] = {'queries': len(ordered), 'errors': failed, 'qps': len(ordered) / seconds}
+        if ordered:
+            summary[index_uid].update({
+                f"p{int(fraction * 100)}_ms": percentile(ordered, fraction) * 1000 for fraction in (0.5, 0.95, 0.99)
+            })
+            summary[index_uid]['mean_ms'] = sum(ordered) / len(ordered) * 1000
+    return summary
+
+def benchmark(args):
+    variants = load_variants(args.variants)
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'cpu_count': os.cpu_count(),
+        'backend': args.meili_binary or 'stub',
+        'corpus': args.data_dir or {
+            'pdfs': args.pdfs,
+            'pdf_pages': args.pdf_pages,
+            'sites': args.sites,
+            'html_files': args.html_files,
+            'page_words': args.page_words,
+            'seed': args.seed
+        },
+        'query_log': args.query_log,
+        'concurrency': args.concurrency,
+        'variants': {}
+    }
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="search-bench-") as tmp:
+        root = Path(tmp)
+        if args.data_dir:
+            data_dir = Path(args.data_dir)
+        else:
+            data_dir, _ = generate_corpus(root, args)
+
+        queries = load_query_log(args.query_log) if args.query_log else None
+        for variant in variants:
+            name = variant['name']
+            with search_backend(args, root, name) as url, open(root / f"index-{name}.log", 'w') as log:
+                index_seconds, stats = build_indexes(url, data_dir, root / f"state-{name}", variant['settings'], log)
+                if queries is None:
+                    # Generated once, so every variant answers the same queries
+                    queries = generate_queries(index_content.Client(url, MASTER_KEY), args.queries, rng)
+                if not queries:
+                    raise SystemExit("No queries to run, the corpus has no titles and no --query-log was given")
+
+                latencies, errors, seconds = asyncio.run(replay(url, queries, args.concurrency, args.warmup))
+            report['variants'][name] = {
+                'settings': variant['settings'],
+                'index_seconds': index_seconds,
+                'database_size': stats.get('databaseSize'),
+                'documents': {
+                    index_uid: stats.get('indexes', {}).get(index_uid, {}).get('numberOfDocuments', 0)
+                    for index_uid in INDEXES
+                },
+                'latency': summarize(latencies, errors, seconds)
+            }
+            print(f"{name}: indexed in {index_seconds:.1f}s, ran {len(queries)} queries in {seconds:.1f}s")
+
+    return report
+
+def print_table(report):
+    """Print variants side by side, one row per variant and index, with the database size once per variant"""
+    print(f"\n{'variant':<20} {'index':<10} {'qps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, variant in report['variants'].items():
+        for index_uid, latency in variant['latency'].items():
+            print(
+                f"{name:<20} {index_uid:<10} {latency['qps']:>8.1f} {latency.get('p50_ms', 0):>8.2f} "
+                f"{latency.get('p95_ms', 0):>8.2f} {latency.get('p99_ms', 0):>8.2f} {latency['errors']:>7}"
+            )
+        # Meilisearch only reports the size of the whole database, not of each index
+        size = variant['database_size']
+        if size is not None:
+            print(f"{name:<20} {'database':<10} {size / (1024 * 1024):.1f} MB for all indices")
+
+def compare(report, baseline):
+    """Print QPS and tail latency changes per variant and index against an earlier report"""
+    print(f"\nCompared with run from {baseline.get('started_at', 'unknown')}:")
+    for name, variant in report['variants'].items():
+        before = baseline.get('variants', {}).get(name)
+        if not before:
+            print(f"  {name}: no baseline")
+            continue
+        for index_uid, latency in variant['latency'].items():
+            previous = before['latency'].get(index_uid)
+            if not previous or not previous['qps'] or 'p95_ms' not in previous or 'p95_ms' not in latency:
+                print(f"  {name} {index_uid}: no baseline")
+                continue
+            print(f"  {name} {index_uid}: {latency['qps'] / previous['qps'] - 1:+.1%} qps, "
+                  f"{latency['p95_ms'] / previous['p95_ms'] - 1:+.1%} p95")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--variants', help="TOML file of index settings variants, see search_variants.toml")
+    parser.add_argument('--meili-binary', help="local meilisearch binary to test instead of the stub")
+    parser.add_argument('--data-dir', help="index this /data tree instead of a synthetic corpus")
+    parser.add_argument('--query-log', help="queries to replay, one per line as text or JSON")
+    parser.add_argument('--queries', type=int, default=2000, help="queries to generate without a log")
+    parser.add_argument('--concurrency', type=int, default=8, help="searches in flight at once")
+    parser.add_argument('--warmup', type=int, default=50, help="unmeasured queries sent first")
+    parser.add_argument('--pdfs', type=int, default=30, help="number of synthetic PDFs")
+    parser.add_argument('--pdf-pages', type=int, default=20, help="pages per PDF")
+    parser.add_argument('--sites', type=int, default=5, help="number of mirrored sites")
+    parser.add_argument('--html-files', type=int, default=2000, help="HTML files across all sites")
+    parser.add_argument('--page-words', type=int, default=300, help="words per PDF page and HTML page")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=f"search-bench-{time.strftime('%Y%m%d-%H%M%S')}.json",
+                        help="where to write the JSON report")
+    parser.add_argument('--compare', help="earlier JSON report to compare against")
+    # The synthetic corpus has no ZIM archives, those are not searched here
+    parser.set_defaults(zim_articles=0)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = benchmark(args)
+    print_table(report)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -1,168 +1,421 @@
 #!/usr/bin/env python3
 """
 Convert Kiwix URLs to proper format and generate organized HTML for archive homepage.
+
+Input is either a text file of browse.library.kiwix.org viewer URLs or a local copy
+of the Kiwix OPDS catalog XML, which also provides titles, sizes and download paths.
 """
 
+import os
 import re
-import urllib.parse
-from typing import List, Dict, Tuple
-
-def extract_name_from_url(url: str) -> str:
-    """Extract readable name from Kiwix URL."""
-    # Extract the part after # and before date
-    match = re.search(r'#(.+)$', url)
-    if match:
-        full_name = match.group(1)
-        
-        # Handle devdocs special cases FIRST (before generic mapping)
-        if full_name.startswith('devdocs_'):
-            parts = full_name.split('_')
-            if len(parts) >= 3:
-                tech = parts[2].upper()
-                return f'DevDocs - {tech}'
-        
-        # Handle ted talks FIRST (before generic mapping)
-        if full_name.startswith('ted_'):
-            if 'life' in full_name:
-                return 'TED Talks - Life'
-            elif 'ideas' in full_name:
-                return 'TED Talks - Ideas'
-        
-        # Handle freecodecamp special cases
-        if full_name.startswith('freecodecamp_'):
-            if 'project-euler' in full_name:
-                return 'freeCodeCamp - Project Euler'
-            else:
-                return 'freeCodeCamp'
-        
-        # Handle gutenberg categories FIRST (before generic mapping)
-        if full_name.startswith('gutenberg_en_lcc-'):
-            category = full_name.split('-')[-1].upper()
-            return f'Project Gutenberg - Category {category}'
-        
-        # Handle wikipedia variants FIRST (before generic mapping)
-        if full_name.startswith('wikipedia_'):
-            if 'wp1-0.8' in full_name:
-                return 'Wikipedia - Simple English'
-            elif 'nopic' in full_name:
-                return 'Wikipedia - No Images'
-        
-        # Extract base name for generic mapping (remove date and variant info)
-        name_parts = full_name.split('_')
-        base_name = name_parts[0]
-        
-        # Generic name mapping (only for non-special cases)
-        name_mapping = {
-            'php.net': 'PHP Documentation',
-            'archlinux': 'Arch Linux Wiki',
-            'finiki': 'Financial Wiki',
-            'docs.python.org': 'Python Documentation',
-            'medlineplus.gov': 'MedlinePlus',
-            'openstreetmap-wiki': 'OpenStreetMap Wiki',
-            'termux': 'Termux Wiki',
-            'urban-prepper': 'Urban Prepper',
-            'citizendium.org': 'Citizendium',
-            'fas-military-medicine': 'Military Medicine',
-            'quickguidesformedicine': 'Quick Medical Guides',
-            'internet-encyclopedia-philosophy': 'Internet Encyclopedia of Philosophy',
-            'libretexts.org': 'LibreTexts',
-            'wikitech': 'WikiTech',
-            'internetarchive': 'Internet Archive'
-        }
-        
-        return name_mapping.get(base_name, base_name.replace('-', ' ').title())
+import json
+import string
+import struct
+import hashlib
+import tomllib
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from urllib.parse import quote
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+
+try:
+    from libzim.reader import Archive
+except ImportError:
+    Archive = None
+
+DEFAULT_RULES = Path(__file__).with_name('archive_rules.toml')
+LOCAL_VIEWER_URL = "https://archive.brennan.page/kiwix/"
+DOWNLOAD_URL = "https://download.kiwix.org/zim/zimit/{content_id}.zim"
+
+VIEWER_URL = re.compile(r'https://browse\.library\.kiwix\.org/viewer#.+')
+CONTENT_ID = re.compile(r'#(.+)$')
+DATE = re.compile(r'\d{4}-\d{2}')
+ZIM_ACQUISITION = 'application/x-zim'
+# Bumped whenever the generated markup changes, forcing cached pages to be rewritten
+HTML_FORMAT = 3
+DEFAULT_ZIM_DIR = '/zims'
+# Magic number, format version, UUID and entry count from the start of the ZIM header
+ZIM_HEADER = struct.Struct('<IHH16sI')
+ZIM_MAGIC = 72173914
+SEARCH_INDEX_VERSION = 1
+SEARCH_TOKEN = re.compile(r'[a-z0-9]+')
+
+def compile_template(template: str) -> Callable[[Dict[str, str]], str]:
+    """Compile a name template once, supporting the :upper and :title case specs."""
+    parts = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        if field is not None and (conversion or spec not in ('', 'upper', 'title')):
+            raise ValueError(f"Unsupported format in name template '{template}'")
+        parts.append((literal, field, spec))
+    
+    def render(fields: Dict[str, str]) -> str:
+        out = []
+        for literal, field, spec in parts:
+            out.append(literal)
+            if field is not None:
+                value = fields.get(field) or ''
+                out.append(value.upper() if spec == 'upper' else value.title() if spec == 'title' else value)
+        return ''.join(out)
+    
+    return render
+
+def parse_content_id(content_id: str) -> Dict[str, str]:
+    """Split a content id such as devdocs_en_python_2026-01 into its fields."""
+    tokens = content_id.split('_')
+    date = tokens.pop() if len(tokens) > 1 and DATE.fullmatch(tokens[-1]) else ''
+    return {
+        'id': content_id,
+        'project': tokens[0],
+        'lang': tokens[1] if len(tokens) > 1 else '',
+        'flavour': '_'.join(tokens[2:]),
+        'date': date
+    }
+
+class ArchiveClassifier:
+    """Names and categorizes archives from a rule table, parsing each URL once."""
+    
+    def __init__(self, rules: Dict):
+        self.default_category = rules.get('default_category', 'General Knowledge')
+        self.project_names = dict(rules.get('projects', {}))
+        
+        # Name rules grouped by project, so each archive only tries its own
+        self.name_rules: Dict[str, List[Tuple[Optional[re.Pattern], Callable]]] = {}
+        for rule in rules.get('names', []):
+            flavour = re.compile(rule['flavour']) if 'flavour' in rule else None
+            self.name_rules.setdefault(rule['project'], []).append((flavour, compile_template(rule['name'])))
+        
+        self.category_rules = [
+            (
+                rule['name'],
+                frozenset(rule.get('projects', [])),
+                re.compile('|'.join(map(re.escape, rule['keywords']))) if rule.get('keywords') else None
+            )
+            for rule in rules.get('categories', [])
+        ]
+        # Categories only depend on the project, which repeats across a catalog
+        self.project_categories: Dict[str, str] = {}
+        # Identifies the rule table in cached manifests, so editing a rule invalidates them
+        self.fingerprint = hashlib.sha256(json.dumps(rules, sort_keys=True, default=str).encode()).hexdigest()
     
-    return "Unknown"
-
-def generate_download_url(viewer_url: str) -> str:
-    """Convert viewer URL to download URL."""
-    # Extract the content identifier from viewer URL
-    match = re.search(r'#(.+)$', viewer_url)
-    if match:
-        content_id = match.group(1)
-        # Convert to download URL format
-        return f"https://download.kiwix.org/zim/zimit/{content_id}.zim"
+    def name(self, fields: Dict[str, str]) -> str:
+        """Readable name of an archive."""
+        for flavour, render in self.name_rules.get(fields['project'], ()):
+            if flavour is None:
+                return render(fields)
+            match = flavour.search(fields['flavour'])
+            if match:
+                return render({**fields, **match.groupdict()})
+        
+        project = fields['project']
+        return self.project_names.get(project) or project.replace('-', ' ').title()
     
-    return viewer_url
-
-def generate_local_viewer_url(viewer_url: str) -> str:
-    """Generate local viewer URL for self-hosted Kiwix service."""
-    # Extract the content identifier from viewer URL
-    match = re.search(r'#(.+)$', viewer_url)
-    if match:
-        content_id = match.group(1)
-        # Point to the library interface - this works reliably
-        # Users can click on the archive to open it
-        return f"https://archive.brennan.page/kiwix/"
+    def category(self, fields: Dict[str, str]) -> str:
+        """Category of an archive, the first matching rule wins."""
+        project = fields['project']
+        category = self.project_categories.get(project)
+        if category is None:
+            category = self.default_category
+            for name, projects, keywords in self.category_rules:
+                if project in projects or (keywords and keywords.search(project)):
+                    category = name
+                    break
+            self.project_categories[project] = category
+        return category
     
-    return viewer_url
+    def classify(self, url: str) -> Optional[Dict[str, str]]:
+        """Archive entry for a Kiwix viewer URL, or None if it has no content id."""
+        match = CONTENT_ID.search(url)
+        if not match:
+            return None
+        fields = parse_content_id(match.group(1))
+        return {
+            'content_id': fields['id'],
+            'name': self.name(fields),
+            'viewer_url': LOCAL_VIEWER_URL,
+            'download_url': DOWNLOAD_URL.format(content_id=fields['id']),
+            'category': self.category(fields)
+        }
+
+def load_classifier(rules_file: Path = DEFAULT_RULES) -> ArchiveClassifier:
+    """Load the naming and category rules."""
+    with open(rules_file, 'rb') as f:
+        return ArchiveClassifier(tomllib.load(f))
+
+def read_url_list(input_file: str, classifier: ArchiveClassifier) -> Iterator[Dict]:
+    """Yield archives for the viewer URLs in a text file, line by line."""
+    with open(input_file, 'r') as f:
+        for line in f:
+            for url in VIEWER_URL.findall(line):
+                archive = classifier.classify(url)
+                if archive:
+                    yield archive
 
-def categorize_archive(name: str, url: str) -> str:
-    """Categorize archive based on name and URL."""
-    name_lower = name.lower()
-    url_lower = url.lower()
+def local_name(tag: str) -> str:
+    return tag.rpartition('}')[2]
+
+def opds_archive(entry: ET.Element, classifier: ArchiveClassifier) -> Optional[Dict]:
+    """Archive for one OPDS catalog entry, or None if it has no ZIM download."""
+    fields = {}
+    download = None
+    for child in entry:
+        tag = local_name(child.tag)
+        if tag == 'link':
+            if child.get('type') == ZIM_ACQUISITION:
+                download = child
+        elif tag in ('title', 'language', 'articleCount'):
+            fields[tag] = (child.text or '').strip()
+    if download is None or not download.get('href'):
+        return None
     
-    if 'wikipedia' in name_lower or 'gutenberg' in name_lower or 'citizendium' in name_lower:
-        return 'Encyclopedias'
-    elif 'devdocs' in name_lower or 'python' in name_lower or 'php' in name_lower or 'archlinux' in name_lower:
-        return 'Technical Documentation'
-    elif 'ted' in name_lower or 'freecodecamp' in name_lower:
-        return 'Education'
-    elif 'medline' in name_lower or 'medical' in name_lower or 'medicine' in name_lower:
-        return 'Medical'
-    elif 'openstreetmap' in name_lower or 'termux' in name_lower:
-        return 'Tools & Utilities'
-    elif 'urban-prepper' in name_lower:
-        return 'Prepping'
-    else:
-        return 'General Knowledge'
+    # Acquisition links point at a metalink next to the ZIM file
+    download_url = download.get('href').removesuffix('.meta4')
+    content_id = download_url.rpartition('/')[2].removesuffix('.zim')
+    parsed = parse_content_id(content_id)
+    size = download.get('length')
+    article_count = fields.get('articleCount')
+    return {
+        'content_id': content_id,
+        'name': fields.get('title') or classifier.name(parsed),
+        'viewer_url': LOCAL_VIEWER_URL,
+        'download_url': download_url,
+        'category': classifier.category(parsed),
+        'language': fields.get('language') or parsed['lang'],
+        'size': int(size) if size and size.isdigit() else None,
+        'article_count': int(article_count) if article_count and article_count.isdigit() else None
+    }
+
+def read_opds_catalog(input_file: str, classifier: ArchiveClassifier) -> Iterator[Dict]:
+    """Yield archives from a Kiwix OPDS catalog, parsing it incrementally in constant memory."""
+    root = None
+    for event, element in ET.iterparse(input_file, events=('start', 'end')):
+        if root is None:
+            root = element
+        elif event == 'end' and local_name(element.tag) == 'entry':
+            archive = opds_archive(element, classifier)
+            if archive:
+                yield archive
+            # Drop finished entries, the root would otherwise keep every one of them
+            root.clear()
 
-def convert_urls(input_file: str, output_file: str = None) -> Tuple[List[Dict], str]:
-    """Convert URLs from input file and return structured data and HTML."""
-    archives = []
+def read_zim_metadata(zim_file: Path) -> Dict:
+    """Header and metadata of a ZIM file, without touching any article data."""
+    with open(zim_file, 'rb') as f:
+        header = f.read(ZIM_HEADER.size)
+    if len(header) < ZIM_HEADER.size:
+        raise ValueError("truncated ZIM header")
+    magic, major, minor, uuid, entry_count = ZIM_HEADER.unpack(header)
+    if magic != ZIM_MAGIC:
+        raise ValueError("not a ZIM file")
+    info = {'uuid': uuid.hex(), 'version': f"{major}.{minor}", 'entry_count': entry_count}
     
-    with open(input_file, 'r') as f:
-        content = f.read()
+    # Counting articles and reading metadata needs the directory, which libzim opens lazily
+    if Archive is not None:
+        archive = Archive(zim_file)
+        info['article_count'] = archive.article_count
+        keys = set(archive.metadata_keys)
+        for key in ('Title', 'Date', 'Language'):
+            if key in keys:
+                info[key.lower()] = archive.get_metadata(key).decode('utf-8', errors='replace')
+    return info
+
+class ZimScanner:
+    """Scans a ZIM directory, reopening only files whose size or mtime changed since the last scan."""
     
-    # Find all URLs
-    urls = re.findall(r'https://browse\.library\.kiwix\.org/viewer#.+', content)
+    def __init__(self, zim_dir: str, cache: Optional[Dict[str, Dict]] = None):
+        self.zim_dir = Path(zim_dir)
+        self.cache = cache or {}
     
-    for url in urls:
-        name = extract_name_from_url(url)
-        download_url = generate_download_url(url)
-        local_viewer_url = generate_local_viewer_url(url)
-        category = categorize_archive(name, url)
-        
-        archives.append({
-            'name': name,
-            'viewer_url': local_viewer_url,
-            'download_url': download_url,
-            'category': category
-        })
+    def scan(self) -> Dict[str, Dict]:
+        """Metadata of every local ZIM file, keyed by its book name."""
+        zims = {}
+        for zim_file in sorted(self.zim_dir.glob('*.zim')):
+            stat = zim_file.stat()
+            cached = self.cache.get(zim_file.stem)
+            if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+                zims[zim_file.stem] = cached
+                continue
+            try:
+                info = read_zim_metadata(zim_file)
+            except Exception as e:
+                print(f"⚠️  Skipping {zim_file.name}: {e}")
+                continue
+            zims[zim_file.stem] = {**info, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        self.cache = zims
+        return zims
+
+def book_name(content_id: str) -> str:
+    """Content id without its date, which stays the same across releases of a book."""
+    return content_id.rsplit('_', 1)[0] if DATE.fullmatch(content_id.rpartition('_')[2]) else content_id
+
+def attach_local_zims(archives: List[Dict], zims: Dict[str, Dict]) -> None:
+    """Fill archives with what is on disk, falling back to another release of the same book."""
+    releases = {}
+    for name in sorted(zims):
+        # Sorted, so the newest dated release of a book wins
+        releases[book_name(name)] = name
     
-    # Generate HTML
-    html = generate_archive_html(archives)
+    for archive in archives:
+        name = archive['content_id']
+        if name not in zims:
+            name = releases.get(book_name(name))
+        if name is None:
+            archive['available'] = False
+            continue
+        zim = zims[name]
+        archive['available'] = True
+        archive['viewer_url'] = f"{LOCAL_VIEWER_URL}content/{quote(name)}"
+        archive['size'] = zim['size']
+        if zim.get('article_count') is not None:
+            archive['article_count'] = zim['article_count']
+        date = zim.get('date') or parse_content_id(name)['date']
+        if date:
+            archive['date'] = date
+
+def scan_zims(zim_dir: Optional[str], cache: Optional[Dict[str, Dict]] = None) -> Optional[Dict[str, Dict]]:
+    """Local ZIM metadata, or None when there is no ZIM directory to compare the catalog with."""
+    if not zim_dir or not Path(zim_dir).is_dir():
+        return None
+    return ZimScanner(zim_dir, cache).scan()
+
+def is_xml(input_file: str) -> bool:
+    with open(input_file, 'rb') as f:
+        return f.read(512).lstrip().startswith(b'<')
+
+def convert_urls(input_file: str, output_file: str = None, classifier: ArchiveClassifier = None,
+                 zim_dir: str = None, search_index_file: str = None) -> Tuple[List[Dict], Optional[str]]:
+    """Convert a URL list or OPDS catalog and return structured data, plus the HTML unless it was written to a file."""
+    classifier = classifier or load_classifier()
+    read_archives = read_opds_catalog if is_xml(input_file) else read_url_list
+    archives = list(read_archives(input_file, classifier))
+    zims = scan_zims(zim_dir)
+    if zims is not None:
+        attach_local_zims(archives, zims)
+    
+    search_index_url = Path(search_index_file).name if search_index_file else None
+    
+    if search_index_file:
+        write_search_index(archives, search_index_file)
     
+    # Generate HTML
     if output_file:
-        with open(output_file, 'w') as f:
-            f.write(html)
+        write_archive_html(archives, output_file, search_index_url)
+        return archives, None
     
-    return archives, html
+    return archives, generate_archive_html(archives, search_index_url)
 
-def generate_archive_html(archives: List[Dict]) -> str:
-    """Generate HTML for archive homepage."""
-    # Group by category
+def file_digest(path: str, *extra: str) -> str:
+    """SHA-256 of a file's contents and any extra strings, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    for value in extra:
+        digest.update(value.encode())
+    return digest.hexdigest()
+
+def archives_digest(archives: Dict[str, Dict], search_index_url: Optional[str] = None) -> str:
+    """Hash of the parsed archive list, which is all the homepage depends on besides the search index it loads."""
+    payload = json.dumps(
+        {'format': HTML_FORMAT, 'archives': archives, 'search_index': search_index_url}, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def category_slug(category: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '-', category.lower()).strip('-') or 'category'
+
+def load_manifest(manifest_file: Path) -> Dict:
+    """Cached archive manifest from an earlier run, or an empty one if it is missing or outdated."""
+    try:
+        with open(manifest_file, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return manifest if manifest.get('format') == HTML_FORMAT else {}
+
+def write_atomically(path: Path, content: str) -> None:
+    """Replace a file in one step, so nginx never serves half a page."""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(content, encoding='utf-8')
+    os.replace(tmp_path, path)
+
+def sync_archive_html(input_file: str, output_file: str, manifest_file: str, classifier: ArchiveClassifier = None,
+                      zim_dir: str = None, search_index_file: str = None) -> Tuple[List[Dict], List[str]]:
+    """Regenerate the homepage and per-category fragments only where the archive manifest changed.
+
+    Returns the archives and the paths that were rewritten, which is empty when nothing changed.
+    """
+    classifier = classifier or load_classifier()
+    output = Path(output_file)
+    manifest_file = Path(manifest_file)
+    fragments_dir = output.with_name(f"{output.stem}_categories")
+    manifest = load_manifest(manifest_file)
+    
+    # Cached by mtime, so only new or changed ZIM files are opened
+    zims = scan_zims(zim_dir, manifest.get('zims'))
+    
+    # An unchanged input, rule table and ZIM directory cannot produce different archives, so skip parsing
+    search_index_url = Path(search_index_file).name if search_index_file else None
+    source = file_digest(input_file, classifier.fingerprint, json.dumps(zims, sort_keys=True), str(search_index_url))
+    if manifest.get('source') == source and output.exists():
+        return list(manifest['archives'].values()), []
+    
+    read_archives = read_opds_catalog if is_xml(input_file) else read_url_list
+    entries = {archive['content_id']: archive for archive in read_archives(input_file, classifier)}
+    archives = list(entries.values())
+    if zims is not None:
+        attach_local_zims(archives, zims)
+    digest = archives_digest(entries, search_index_url)
+    written = []
+    
+    if manifest.get('hash') != digest or not output.exists():
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp_output = output.with_name(f".{output.name}.tmp")
+        write_archive_html(archives, tmp_output, search_index_url)
+        os.replace(tmp_output, output)
+        written.append(str(output))
+    
+    # The search index is its own stage, rebuilt from the same archives whenever they change
+    if search_index_file and (manifest.get('hash') != digest or not Path(search_index_file).exists()):
+        write_search_index(archives, search_index_file)
+        written.append(str(search_index_file))
+    
     categories = {}
     for archive in archives:
-        cat = archive['category']
-        if cat not in categories:
-            categories[cat] = []
-        categories[cat].append(archive)
+        categories.setdefault(archive['category'], []).append(archive)
+    
+    # Fragments are rewritten one category at a time, and only when their markup changed
+    old_fragments = manifest.get('categories', {})
+    fragments = {}
+    fragments_dir.mkdir(parents=True, exist_ok=True)
+    for category in sorted(categories):
+        html = ''.join(iter_category_html(category, categories[category]))
+        fragment = {
+            'file': f"{category_slug(category)}.html",
+            'hash': hashlib.sha256(html.encode()).hexdigest()
+        }
+        path = fragments_dir / fragment['file']
+        if old_fragments.get(category) != fragment or not path.exists():
+            write_atomically(path, html)
+            written.append(str(path))
+        fragments[category] = fragment
     
-    # Sort categories and archives within each category
-    sorted_categories = sorted(categories.keys())
+    for category, fragment in old_fragments.items():
+        if category not in fragments:
+            (fragments_dir / fragment['file']).unlink(missing_ok=True)
     
-    html = """<!DOCTYPE html>
+    manifest = {
+        'format': HTML_FORMAT,
+        'source': source,
+        'hash': digest,
+        'archives': entries,
+        'categories': fragments,
+        'zims': zims
+    }
+    write_atomically(manifest_file, json.dumps(manifest, ensure_ascii=False, indent=2))
+    return archives, written
+
+# Placeholders are filled in by iter_archive_html, the CSS braces are left alone
+PAGE_TEMPLATE = """<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -372,59 +625,227 @@ def generate_archive_html(archives: List[Dict]) -> str:
                 <div class="stat-label">Categories</div>
             </div>
             <div class="stat">
-                <div class="stat-number">24/7</div>
+                <div class="stat-number">{available_archives}</div>
                 <div class="stat-label">Available</div>
             </div>
-        </div>
+        </div>{search_box}
         
         {categories_html}
         
         <footer class="footer">
             <p>Powered by Kiwix | Part of brennan.page Homelab</p>
         </footer>
-    </div>
+    </div>{search_script}
 </body>
 </html>"""
-    
-    # Generate categories HTML
-    categories_html = ""
-    for category in sorted_categories:
-        archives_html = ""
-        for archive in sorted(categories[category], key=lambda x: x['name']):
-            archives_html += f"""
-                <div class="archive-card">
-                    <div class="archive-title">{archive['name']}</div>
-                    <div class="archive-links">
-                        <a href="{archive['viewer_url']}" class="btn btn-view" target="_blank">📖 View</a>
-                        <a href="{archive['download_url']}" class="btn btn-download" target="_blank">⬇️ Download</a>
-                    </div>
-                </div>"""
+PAGE_PARTS = re.split(
+    r'\{(total_archives|total_categories|available_archives|search_box|categories_html|search_script)\}', PAGE_TEMPLATE
+)
+
+SEARCH_BOX = """
         
-        categories_html += f"""
+        <div class="search" style="margin-bottom: 25px;">
+            <input id="archive-search" type="search" placeholder="Filter archives…" aria-label="Filter archives"
+                   data-index="{index_url}" disabled
+                   style="width: 100%; padding: 12px 18px; border: none; border-radius: 10px; font-size: 1rem; box-shadow: 0 5px 15px rgba(0,0,0,0.1);">
+        </div>"""
+
+# Filters cards against the prebuilt index: binary search for each query word's prefix in
+# the sorted term list, then intersect postings, so no text is scanned while typing
+SEARCH_SCRIPT = """
+    <script>
+    (function () {
+        var input = document.getElementById('archive-search');
+        var cards = {};
+        var index = null;
+        document.querySelectorAll('.archive-card[data-archive]').forEach(function (card) {
+            cards[card.dataset.archive] = card;
+        });
+        
+        function firstTerm(prefix) {
+            var low = 0, high = index.terms.length;
+            while (low < high) {
+                var mid = (low + high) >> 1;
+                if (index.terms[mid] < prefix) { low = mid + 1; } else { high = mid; }
+            }
+            return low;
+        }
+        
+        function matching(word) {
+            var found = new Set();
+            for (var i = firstTerm(word); i < index.terms.length && index.terms[i].startsWith(word); i++) {
+                index.postings[i].forEach(function (doc) { found.add(doc); });
+            }
+            return found;
+        }
+        
+        function filter() {
+            var visible = null;
+            (input.value.toLowerCase().match(/[a-z0-9]+/g) || []).forEach(function (word) {
+                var found = matching(word);
+                visible = visible === null ? found : new Set(Array.from(visible).filter(function (doc) { return found.has(doc); }));
+            });
+            index.ids.forEach(function (id, doc) {
+                if (cards[id]) { cards[id].hidden = visible !== null && !visible.has(doc); }
+            });
+            document.querySelectorAll('.category').forEach(function (category) {
+                category.hidden = !category.querySelector('.archive-card:not([hidden])');
+            });
+        }
+        
+        fetch(input.dataset.index).then(function (response) { return response.json(); }).then(function (data) {
+            index = data;
+            input.disabled = false;
+            input.addEventListener('input', filter);
+            filter();
+        });
+    })();
+    </script>"""
+
+
+# An ampersand only needs escaping where it could start a character reference
+HTML_SPECIAL = re.compile(r'&(?=[#A-Za-z0-9])|[<>"\']')
+HTML_ESCAPES = {'<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#x27;'}
+
+def escape_html(text: str) -> str:
+    """Escape text for element content and quoted attributes."""
+    return HTML_SPECIAL.sub(lambda match: HTML_ESCAPES.get(match.group(), '&amp;'), text)
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'TB'
+    return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+
+def archive_details(archive: Dict) -> str:
+    """Language, size, article count and date line for archives read from a catalog or found on disk."""
+    details = []
+    if archive.get('language'):
+        details.append(archive['language'])
+    if archive.get('size'):
+        details.append(format_size(archive['size']))
+    if archive.get('article_count'):
+        details.append(f"{archive['article_count']:,} articles")
+    if archive.get('date'):
+        details.append(archive['date'])
+    if archive.get('available') is False:
+        details.append('not downloaded')
+    if not details:
+        return ''
+    return f"""
+                    <div class="archive-details" style="color: #718096; font-size: 0.85rem; margin-bottom: 10px;">{escape_html(' · '.join(details))}</div>"""
+
+def iter_category_html(category: str, archives: List[Dict]) -> Iterator[str]:
+    """Yield the HTML of one category and its archive cards."""
+    yield f"""
         <div class="category">
-            <h2>{category} ({len(categories[category])})</h2>
+            <h2>{escape_html(category)} ({len(archives)})</h2>
             <div class="archives">
-                {archives_html}
+                """
+    for archive in sorted(archives, key=lambda x: x['name']):
+        # Archives missing from the ZIM directory have nothing to view yet
+        view_link = '' if archive.get('available') is False else f"""
+                        <a href="{escape_html(archive['viewer_url'])}" class="btn btn-view" target="_blank">📖 View</a>"""
+        yield f"""
+                <div class="archive-card" data-archive="{escape_html(archive['content_id'])}">
+                    <div class="archive-title">{escape_html(archive['name'])}</div>{archive_details(archive)}
+                    <div class="archive-links">{view_link}
+                        <a href="{escape_html(archive['download_url'])}" class="btn btn-download" target="_blank">⬇️ Download</a>
+                    </div>
+                </div>"""
+    yield """
             </div>
         </div>"""
+
+def available_count(archives: List[Dict]) -> str:
+    """Number of archives found on disk, or 24/7 when no ZIM directory was scanned."""
+    if not any('available' in archive for archive in archives):
+        return '24/7'
+    return str(sum(1 for archive in archives if archive['available']))
+
+def iter_archive_html(archives: List[Dict], search_index_url: Optional[str] = None) -> Iterator[str]:
+    """Yield the archive homepage in chunks, so it never has to be built in memory.
+
+    With a search index URL the page gets a filter box that loads it, without one it has none.
+    """
+    # Group by category
+    categories = {}
+    for archive in archives:
+        categories.setdefault(archive['category'], []).append(archive)
     
-    # Replace placeholders
-    html = html.replace("{total_archives}", str(len(archives)))
-    html = html.replace("{total_categories}", str(len(sorted_categories)))
-    html = html.replace("{categories_html}", categories_html)
-    
-    return html
+    values = {
+        'total_archives': lambda: [str(len(archives))],
+        'total_categories': lambda: [str(len(categories))],
+        'available_archives': lambda: [available_count(archives)],
+        'search_box': lambda: [SEARCH_BOX.format(index_url=escape_html(search_index_url)) if search_index_url else ''],
+        'search_script': lambda: [SEARCH_SCRIPT if search_index_url else ''],
+        'categories_html': lambda: (
+            chunk for category in sorted(categories) for chunk in iter_category_html(category, categories[category])
+        )
+    }
+    # PAGE_PARTS alternates literal template text and placeholder names
+    for index, part in enumerate(PAGE_PARTS):
+        if index % 2:
+            yield from values[part]()
+        else:
+            yield part
+
+def generate_archive_html(archives: List[Dict], search_index_url: Optional[str] = None) -> str:
+    """Generate HTML for archive homepage."""
+    return ''.join(iter_archive_html(archives, search_index_url))
+
+def build_search_index(archives: List[Dict]) -> Dict:
+    """Inverted index over archive names and categories, with terms sorted for prefix lookups."""
+    postings: Dict[str, List[int]] = {}
+    for doc, archive in enumerate(archives):
+        words = SEARCH_TOKEN.findall(f"{archive['name']} {archive['category']}".lower())
+        for word in dict.fromkeys(words):
+            postings.setdefault(word, []).append(doc)
+    terms = sorted(postings)
+    return {
+        'version': SEARCH_INDEX_VERSION,
+        'ids': [archive['content_id'] for archive in archives],
+        'terms': terms,
+        'postings': [postings[term] for term in terms]
+    }
+
+def write_search_index(archives: List[Dict], index_file: str) -> None:
+    """Write the compact search index the homepage filters its cards with."""
+    write_atomically(Path(index_file), json.dumps(build_search_index(archives), separators=(',', ':')))
+
+def write_archive_html(archives: List[Dict], output_file: str, search_index_url: Optional[str] = None) -> None:
+    """Stream the archive homepage straight to a file."""
+    with open(output_file, 'w') as f:
+        f.writelines(iter_archive_html(archives, search_index_url))
 
 if __name__ == "__main__":
     import sys
     
     input_file = sys.argv[1] if len(sys.argv) > 1 else "Docker KiwiX URLs.txt"
     output_file = sys.argv[2] if len(sys.argv) > 2 else "archive_homepage.html"
+    # The manifest sits next to the page, nothing is cached when writing to /dev/null
+    default_manifest = None if output_file == os.devnull else str(Path(output_file).with_suffix('.manifest.json'))
+    manifest_file = sys.argv[3] if len(sys.argv) > 3 else default_manifest
+    zim_dir = os.getenv("ZIMDIR", DEFAULT_ZIM_DIR)
+    search_index_file = None if output_file == os.devnull else str(Path(output_file).with_suffix('.search.json'))
     
     try:
-        archives, html = convert_urls(input_file, output_file)
-        print(f"✅ Processed {len(archives)} archives")
-        print(f"📁 Generated {output_file}")
+        if manifest_file:
+            archives, written = sync_archive_html(
+                input_file, output_file, manifest_file, zim_dir=zim_dir, search_index_file=search_index_file
+            )
+            print(f"✅ Processed {len(archives)} archives")
+            if written:
+                print(f"📁 Updated {len(written)} files: {', '.join(written)}")
+            else:
+                print(f"⏭️  {output_file} is up to date")
+        else:
+            archives, html = convert_urls(input_file, output_file, zim_dir=zim_dir, search_index_file=search_index_file)
+            print(f"✅ Processed {len(archives)} archives")
+            print(f"📁 Generated {output_file}")
         
         # Print summary by category
         categories = {}
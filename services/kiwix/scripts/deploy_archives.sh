@@ -26,6 +26,10 @@ deploy_service() {
     fi
 }
 
+# Regenerate the archive homepage, a no-op when the URL list and rules are unchanged
+echo "🏠 Updating archive homepage..."
+ZIMDIR=/Users/brennan/Documents/GitHub/brennan.page/services/kiwix/zims python3 /Users/brennan/Documents/GitHub/brennan.page/services/kiwix/scripts/convert_urls.py "/Users/brennan/Documents/GitHub/brennan.page/Docker KiwiX URLs.txt" /Users/brennan/Documents/GitHub/brennan.page/services/kiwix/www/index.html | sed -n 1,2p
+
 # Deploy Kiwix Archive service
 echo "📚 Deploying Kiwix Archive service..."
 deploy_service "/Users/brennan/Documents/GitHub/brennan.page/services/kiwix" "Kiwix Archive"
@@ -1,193 +1,2258 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import json
+import mmap
+import codecs
 import time
+import heapq
+import queue
+import signal
+import shutil
+import asyncio
+import hashlib
+import posixpath
+import sqlite3
+import tomllib
+import threading
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
+from urllib.parse import unquote
 from meilisearch import Client
+from meilisearch.errors import MeilisearchApiError, MeilisearchError
 from bs4 import BeautifulSoup
 import zipfile
 import pdfplumber
 
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    from libzim.reader import Archive
+except ImportError:
+    Archive = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+# Used when no collection file is configured, see pdf_collections.toml
+DEFAULT_PDF_COLLECTIONS = [
+    {'category': 'survival'},
+    {'category': 'medical'},
+    {'category': 'gardening'},
+    {'category': 'technical'}
+]
+PDF_COLLECTION_KEYS = {'category', 'directory', 'glob', 'priority', 'pages_per_task', 'timeout', 'max_pages'}
+
+# Pages whose SimHashes differ in at most this many bits are near-duplicates
+SIMHASH_DISTANCE = 3
+# Pages with less text than this are never deduplicated, their titles usually tell them apart
+DEDUP_MIN_WORDS = 20
+SIMHASH_MIN_WORDS = 50
+SIMHASH_MAX_WORDS = 5000
+BIT_TABLES = [bytes(value >> bit & 1 for value in range(256)) for bit in range(8)]
+
+INDEX_SETTINGS = {
+    # PDFs and documents
+    'documents': {
+        'searchableAttributes': ['title', 'content', 'category'],
+        'filterableAttributes': ['category', 'source', 'page'],
+        'sortableAttributes': ['title']
+    },
+    # Mirrored websites
+    'websites': {
+        'searchableAttributes': ['title', 'description', 'content', 'url', 'site_name'],
+        'filterableAttributes': ['site_name'],
+        'sortableAttributes': ['title', 'rank'],
+        # Meilisearch's defaults, then link popularity to order equally relevant pages
+        'rankingRules': ['words', 'typo', 'proximity', 'attribute', 'sort', 'exactness', 'rank:desc']
+    },
+    # Articles inside ZIM archives
+    'zim_articles': {
+        'searchableAttributes': ['title', 'content', 'zim'],
+        'filterableAttributes': ['zim'],
+        'sortableAttributes': ['title']
+    }
+}
+
+INDEX_MODES = ['threads', 'async']
+INDEX_STAGES = ['pdfs', 'websites', 'zims']
+# Checkpoints are kept per stage, the manifest per index
+STAGE_OF_INDEX = {'documents': 'pdfs', 'websites': 'websites', 'zim_articles': 'zims'}
+# Meilisearch task states after which a task never changes again
+TASK_DONE = ('succeeded', 'failed', 'canceled')
+
+# Link popularity of mirrored pages, see page_rank()
+RANK_DAMPING = 0.85
+RANK_TOLERANCE = 1e-6
+RANK_MAX_ITERATIONS = 100
+# Links with a scheme or host point outside the mirror, wget --convert-links leaves those absolute
+EXTERNAL_LINK = re.compile(r'^(?:[A-Za-z][A-Za-z0-9+.-]*:|//)')
+
+# Progress is saved after this many ZIM entries have been indexed
+ZIM_CHECKPOINT_ENTRIES = 1000
+
+# Bumped whenever the documents built for an index change shape, forcing a full re-index
+INDEX_FORMATS = {
+    'documents': 3,
+    'websites': 6
+}
+
+def settings_match(current, wanted):
+    """Compare index settings, ignoring order where Meilisearch treats a list as a set"""
+    for key, value in wanted.items():
+        if key in ('searchableAttributes', 'rankingRules'):
+            if current.get(key) != value:
+                return False
+        elif sorted(current.get(key) or []) != sorted(value):
+            return False
+    return True
+
+# Elements whose text is never page content. Form controls go rather than whole forms,
+# since some sites (ASP.NET WebForms) wrap their entire body in one <form>.
+BOILERPLATE_TAGS = [
+    'script', 'style', 'noscript', 'template', 'svg', 'iframe',
+    'nav', 'header', 'footer', 'aside', 'input', 'select', 'button', 'textarea'
+]
+
+# Mirrored "HTML" files are sniffed from their first bytes before parsing
+SNIFF_BYTES = 4096
+# Pages at least this large are memory-mapped instead of read into memory
+MMAP_MIN_BYTES = 1024 * 1024
+PARSE_CHUNK_BYTES = 256 * 1024
+BINARY_SIGNATURES = {
+    b'%PDF-': 'pdf',
+    b'\x89PNG': 'png',
+    b'GIF8': 'gif',
+    b'\xff\xd8\xff': 'jpeg',
+    b'RIFF': 'riff',
+    b'PK\x03\x04': 'zip',
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bzip2',
+    b'\xfd7zXZ': 'xz',
+    b'7z\xbc\xaf': '7z',
+    b'OggS': 'ogg',
+    b'ID3': 'mp3',
+    b'wOFF': 'woff',
+    b'wOF2': 'woff2',
+    b'\x7fELF': 'elf'
+}
+# Decoded with codecs that drop the byte order mark
+TEXT_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16')
+]
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+
+def load_pdf_collections(path, pages_per_task, timeout):
+    """Read the PDF collection registry and fill in defaults, highest priority first"""
+    if path and Path(path).exists():
+        with open(path, 'rb') as f:
+            entries = tomllib.load(f).get('collection', [])
+    else:
+        if path:
+            print(f"PDF collection file {path} not found, using the default collections")
+        entries = DEFAULT_PDF_COLLECTIONS
+    
+    collections = []
+    for entry in entries:
+        if 'category' not in entry:
+            raise ValueError(f"PDF collection without a category: {entry}")
+        unknown = set(entry) - PDF_COLLECTION_KEYS
+        if unknown:
+            raise ValueError(f"Unknown settings for PDF collection {entry['category']}: {', '.join(sorted(unknown))}")
+        collections.append({
+            'category': entry['category'],
+            'directory': entry.get('directory', entry['category']),
+            'glob': entry.get('glob', '*.pdf'),
+            'priority': int(entry.get('priority', 0)),
+            'pages_per_task': int(entry.get('pages_per_task', pages_per_task)),
+            'timeout': int(entry.get('timeout', timeout)),
+            'max_pages': int(entry.get('max_pages', 0))
+        })
+    return sorted(collections, key=lambda collection: -collection['priority'])
+
+def extract_pdf_pages(pdf_path, first_page, page_count, timeout):
+    """Extract (page_number, text) for a window of pages of a PDF, run inside a worker process"""
+    def on_timeout(signum, frame):
+        raise TimeoutError(f"text extraction exceeded {timeout}s")
+    
+    # Abort this window only, the worker stays available for the next one
+    signal.signal(signal.SIGALRM, on_timeout)
+    signal.alarm(timeout)
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            total_pages = len(pdf.pages)
+            pages = []
+            for number in range(first_page, min(first_page + page_count, total_pages)):
+                page = pdf.pages[number]
+                pages.append((number + 1, page.extract_text() or ""))
+                # Drop the parsed layout so memory stays flat on long documents
+                page.close()
+        return total_pages, pages
+    finally:
+        signal.alarm(0)
+
+class LxmlExtractor:
+    """libxml2-backed extractor, the fast default"""
+    name = 'lxml'
+    available = lxml is not None
+    
+    def extract(self, content):
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+        if isinstance(content, mmap.mmap):
+            # Fed in chunks, so a mapped page is never copied whole into memory
+            for offset in range(0, len(content), PARSE_CHUNK_BYTES):
+                parser.feed(content[offset:offset + PARSE_CHUNK_BYTES])
+            tree = parser.close()
+        else:
+            tree = lxml.html.fromstring(content, parser=parser)
+        title = tree.findtext('.//title')
+        description = tree.xpath(
+            "//meta[translate(@name, 'DESCRIPTION', 'description')='description']/@content"
+        )
+        # Links in navigation count too, so they are collected before boilerplate is stripped
+        hrefs = tree.xpath('//a/@href')
+        
+        etree.strip_elements(tree, etree.Comment, *BOILERPLATE_TAGS, with_tail=False)
+        body = tree.find('body')
+        text = ' '.join((body if body is not None else tree).itertext())
+        return title, description[0] if description else None, text, hrefs
+
+class SelectolaxExtractor:
+    """Lexbor-backed extractor via selectolax"""
+    name = 'selectolax'
+    available = LexborHTMLParser is not None
+    
+    def extract(self, content):
+        tree = LexborHTMLParser(bytes(content))
+        title = tree.css_first('title')
+        description = tree.css_first('meta[name="description" i]')
+        hrefs = [link.attributes.get('href') or '' for link in tree.css('a[href]')]
+        
+        tree.strip_tags(BOILERPLATE_TAGS)
+        body = tree.body or tree.root
+        return (
+            title.text() if title else None,
+            description.attributes.get('content') if description else None,
+            body.text(separator=' ') if body else '',
+            hrefs
+        )
+
+class SoupExtractor:
+    """Pure-Python BeautifulSoup extractor, used when nothing faster is installed"""
+    name = 'bs4'
+    available = True
+    
+    def extract(self, content):
+        soup = BeautifulSoup(bytes(content).decode('utf-8', errors='ignore'), 'html.parser')
+        title = soup.title.string if soup.title else None
+        description = soup.find('meta', attrs={'name': lambda name: name and name.lower() == 'description'})
+        hrefs = [link['href'] for link in soup.find_all('a', href=True)]
+        
+        for element in soup(BOILERPLATE_TAGS):
+            element.decompose()
+        body = soup.body or soup
+        return (
+            title,
+            description.get('content') if description else None,
+            body.get_text(' '),
+            hrefs
+        )
+
+HTML_EXTRACTORS = {
+    extractor.name: extractor for extractor in (LxmlExtractor, SelectolaxExtractor, SoupExtractor)
+}
+
+def get_html_extractor(name):
+    """Return the named extractor, falling back to BeautifulSoup if it is unavailable"""
+    extractor = HTML_EXTRACTORS.get(name)
+    if extractor is None:
+        raise ValueError(f"Unknown HTML extractor '{name}', expected one of {', '.join(HTML_EXTRACTORS)}")
+    if not extractor.available:
+        print(f"HTML extractor '{name}' is not installed, falling back to bs4")
+        extractor = SoupExtractor
+    return extractor()
+
+def iter_html_files(site_dir):
+    """Yield a site's HTML files in a stable, sorted order without listing the whole tree"""
+    for root, dirnames, filenames in os.walk(site_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.html'):
+                yield Path(root) / filename
+
+class SkippedPage(Exception):
+    """A mirrored file that is not worth parsing, such as a renamed binary or a data dump"""
+    
+    def __init__(self, reason, detail):
+        super().__init__(reason, detail)
+        self.reason = reason
+        self.detail = detail
+    
+    def __str__(self):
+        return f"{self.reason} ({self.detail})"
+
+def sniff_page(head, size):
+    """Return the charset of a page from its first bytes, raising SkippedPage if it is not HTML"""
+    for signature, kind in BINARY_SIGNATURES.items():
+        if head.startswith(signature):
+            raise SkippedPage('binary', kind)
+    if head[4:8] == b'ftyp':
+        raise SkippedPage('binary', 'mp4')
+    
+    for bom, charset in TEXT_BOMS:
+        if head.startswith(bom):
+            return charset
+    if b'\0' in head:
+        raise SkippedPage('binary', 'contains NUL bytes')
+    # Tags show up early in real pages, JSON or CSV dumps saved as .html have none
+    if b'<' not in head and len(head) < size:
+        raise SkippedPage('not_html', 'no markup in the first bytes')
+    
+    match = META_CHARSET.search(head)
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+def read_page(html_file, max_bytes=0):
+    """Return a page as UTF-8, memory-mapped when large; raise SkippedPage for binaries and oversized files"""
+    with open(html_file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if max_bytes and size > max_bytes:
+            raise SkippedPage('oversized', f"{size} bytes")
+        head = f.read(SNIFF_BYTES)
+        if not head.strip() and len(head) == size:
+            return b''
+        charset = sniff_page(head, size)
+        
+        if charset not in ('utf-8', 'ascii') or size < MMAP_MIN_BYTES:
+            content = head + f.read()
+            if charset not in ('utf-8', 'ascii'):
+                content = content.decode(charset, errors='replace').encode('utf-8')
+            return content
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def text_signature(text):
+    """Return (sha1, 64-bit SimHash or None) of normalized page text for duplicate detection"""
+    words = text.lower().split()
+    if len(words) < DEDUP_MIN_WORDS:
+        return None, None
+    digest = hashlib.sha1(' '.join(words).encode('utf-8')).hexdigest()
+    
+    # Short pages are only compared exactly, SimHash is too noisy on them
+    if len(words) < SIMHASH_MIN_WORDS:
+        return digest, None
+    
+    # SimHash over word 3-shingles, capped so huge pages stay cheap
+    hashes = b''.join(
+        hashlib.blake2b(' '.join(words[i:i + 3]).encode('utf-8'), digest_size=8).digest()
+        for i in range(min(len(words), SIMHASH_MAX_WORDS) - 2)
+    )
+    threshold = len(hashes) // 16
+    simhash = 0
+    # Count set bits per position with byte slicing and translate, which run in C
+    for byte in range(8):
+        column = hashes[byte::8]
+        for bit in range(8):
+            if column.translate(BIT_TABLES[bit]).count(1) > threshold:
+                simhash |= 1 << (56 - byte * 8 + bit)
+    return digest, simhash
+
+def simhash_bands(simhash):
+    return tuple(simhash >> (16 * band) & 0xFFFF for band in range(4))
+
+def page_doc_id(site_name, rel_path):
+    """Stable document id from a page's full path, since stems repeat across directories"""
+    path_hash = hashlib.sha1(str(rel_path).encode('utf-8')).hexdigest()[:16]
+    return f"site_{re.sub(r'[^A-Za-z0-9_-]', '_', site_name)}_{path_hash}"
+
+def resolve_links(hrefs, rel_path):
+    """Return the mirrored pages a page links to, as paths relative to the mirror root"""
+    page = rel_path.as_posix()
+    site, page_dir = rel_path.parts[0], posixpath.dirname(page)
+    targets = set()
+    for href in hrefs:
+        # wget escapes '?' in saved file names, so a literal one starts a query string
+        href = href.strip().split('#', 1)[0].split('?', 1)[0]
+        if not href or EXTERNAL_LINK.match(href):
+            continue
+        href = unquote(href)
+        # Root-relative links were left alone by wget, their root is the site directory
+        target = posixpath.join(site, href.lstrip('/')) if href.startswith('/') else posixpath.join(page_dir, href)
+        if href.endswith('/'):
+            target = posixpath.join(target, 'index.html')
+        target = posixpath.normpath(target)
+        if target.endswith('.html') and not target.startswith('../') and target != page:
+            targets.add(target)
+    return sorted(targets)
+
+def page_rank(sources, targets, count):
+    """PageRank of pages 0..count-1 linked by edge arrays, scaled so the average page scores 1"""
+    out_degree = np.bincount(sources, minlength=count)
+    # links[target, source] is the share of its score a page passes along each of its links
+    links = sparse.csr_matrix(
+        (1.0 / out_degree[sources], (targets, sources)), shape=(count, count)
+    )
+    dangling = out_degree == 0
+    rank = np.full(count, 1.0 / count)
+    for _ in range(RANK_MAX_ITERATIONS):
+        # Pages without links hand their score to every page, like the random jump
+        jump = ((1 - RANK_DAMPING) + RANK_DAMPING * rank[dangling].sum()) / count
+        updated = RANK_DAMPING * (links @ rank) + jump
+        delta = np.abs(updated - rank).sum()
+        rank = updated
+        if delta < RANK_TOLERANCE:
+            break
+    return rank * count
+
+def pdf_page_doc_id(category, pdf_file, number):
+    """Document id of one PDF page, with the stem cleaned for Meilisearch and a path hash so cleaned stems never collide"""
+    path_hash = hashlib.sha1(str(pdf_file).encode('utf-8')).hexdigest()[:8]
+    stem = re.sub(r'[^A-Za-z0-9_-]', '_', pdf_file.stem)[:100]
+    return f"{re.sub(r'[^A-Za-z0-9_-]', '_', category)}_{stem}_{path_hash}_p{number}"
+
+def build_page_document(content, html_file, mirrored_dir, site_name, extractor):
+    """Build a search document, text signature and outgoing links from the content of one mirrored HTML page"""
+    if content is None:
+        # Mapped pages are not sent to parse workers, they map the file again instead
+        content = read_page(html_file)
+    
+    # Title, meta description, body text and links come from a single parse
+    title, description, text_content, hrefs = None, None, '', []
+    try:
+        if len(content):
+            title, description, text_content, hrefs = extractor.extract(content)
+    finally:
+        if isinstance(content, mmap.mmap):
+            content.close()
+    
+    # Get relative URL
+    rel_path = html_file.relative_to(mirrored_dir)
+    url = f"/{rel_path}"
+    
+    doc = {
+        'id': page_doc_id(site_name, rel_path),
+        'title': ' '.join(title.split()) if title else html_file.stem,
+        'description': ' '.join(description.split()) if description else '',
+        'content': ' '.join(text_content.split())[:3000],  # Limit content
+        'url': url,
+        'site_name': site_name,
+        'file_path': str(html_file)
+    }
+    return doc, text_signature(text_content), resolve_links(hrefs, rel_path)
+
+def timed_call(func, *args):
+    """Call func in a worker process and return (result, seconds) so the parent can record the timing"""
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+def prometheus_labels(**labels):
+    """Render a Prometheus label set, escaping values as the text format requires"""
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def put_unless_stopped(q, item, stop):
+    """Put onto a bounded queue, giving up once the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+class PipelineError:
+    """Queue item carrying an exception raised in a producing thread to its consumer"""
+    
+    def __init__(self, error):
+        self.error = error
+
+class IndexManifest:
+    """SQLite record of indexed files so unchanged files can be skipped between runs"""
+    
+    def __init__(self, db_path):
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Shared between the discovery thread and the uploading thread
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                index_uid TEXT NOT NULL,
+                doc_ids TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                run_id INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS files_by_run ON files (index_uid, run_id)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS formats (index_uid TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS page_texts (
+                path TEXT PRIMARY KEY,
+                site TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                simhash INTEGER,
+                band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER,
+                duplicate_of TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS page_texts_digest ON page_texts (site, digest)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS page_texts_duplicates ON page_texts (duplicate_of)")
+        for band in range(4):
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS page_texts_band{band} ON page_texts (site, band{band})"
+            )
+        # Links between mirrored pages, and the last rank sent to Meilisearch for each page
+        self.conn.execute("CREATE TABLE IF NOT EXISTS page_links (source TEXT NOT NULL, target TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS page_links_source ON page_links (source)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS page_ranks (path TEXT PRIMARY KEY, rank REAL NOT NULL)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS archives (
+                path TEXT PRIMARY KEY,
+                uuid TEXT NOT NULL,
+                next_entry INTEGER NOT NULL,
+                complete INTEGER NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self.run_id = time.time_ns()
+    
+    def ensure_format(self, index_uid, version):
+        """Invalidate every file of an index whose documents were built by an older format"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT version FROM formats WHERE index_uid = ?", (index_uid,)
+            ).fetchone()
+            if (row[0] if row else 1) == version:
+                return
+            # Keep doc_ids so the old documents are still replaced or deleted
+            self.conn.execute(
+                "UPDATE files SET size = -1, sha256 = '' WHERE index_uid = ?", (index_uid,)
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO formats VALUES (?, ?)", (index_uid, version)
+            )
+            self.conn.commit()
+    
+    def check(self, path):
+        """Mark a file as seen and return its fingerprint if it needs (re)indexing, else None"""
+        stat = path.stat()
+        key = str(path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, sha256 FROM files WHERE path = ?", (key,)
+            ).fetchone()
+            
+            # Seen files are never stale, even if extraction fails this run
+            if row:
+                self.conn.execute(
+                    "UPDATE files SET run_id = ? WHERE path = ?", (self.run_id, key)
+                )
+        
+        # Cheap stat comparison first, content hash only when it differs
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return None
+        
+        with open(path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        
+        if row and row[2] == digest:
+            # Touched but unchanged, remember the new mtime
+            with self.lock:
+                self.conn.execute(
+                    "UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                    (stat.st_size, stat.st_mtime_ns, key)
+                )
+            return None
+        
+        return (stat.st_size, stat.st_mtime_ns, digest)
+    
+    def record(self, path, index_uid, doc_ids, fingerprint):
+        """Store a successfully indexed file, returning document ids it no longer produces"""
+        key = str(path)
+        size, mtime_ns, digest = fingerprint
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT doc_ids FROM files WHERE path = ?", (key,)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, index_uid, json.dumps(doc_ids), size, mtime_ns, digest, self.run_id)
+            )
+        obsolete = set(json.loads(row[0])) - set(doc_ids) if row else set()
+        return sorted(obsolete)
+    
+    def stale(self, index_uid):
+        """Return (path, doc_ids) for files of an index that were not seen this run"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, doc_ids FROM files WHERE index_uid = ? AND run_id != ?",
+                (index_uid, self.run_id)
+            ).fetchall()
+        return [(path, json.loads(doc_ids)) for path, doc_ids in rows]
+    
+    def find_duplicate(self, site, path, digest, simhash):
+        """Return the indexed page of a site whose text matches exactly or nearly, if any"""
+        # Stale pages are only forgotten after the walk, so a deleted copy must not be kept
+        with self.lock:
+            for (other,) in self.conn.execute(
+                "SELECT path FROM page_texts WHERE site = ? AND digest = ? AND path != ? AND duplicate_of IS NULL",
+                (site, digest, str(path))
+            ).fetchall():
+                if Path(other).exists():
+                    return other
+            if simhash is None:
+                return None
+            
+            # Pages within SIMHASH_DISTANCE bits share at least one of four 16-bit bands exactly
+            bands = simhash_bands(simhash)
+            candidates = self.conn.execute(
+                "SELECT path, simhash FROM page_texts WHERE site = ? AND path != ? AND duplicate_of IS NULL "
+                "AND (band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?)",
+                (site, str(path), *bands)
+            ).fetchall()
+        for candidate, other in candidates:
+            if (other is not None and bin((other & (2 ** 64 - 1)) ^ simhash).count('1') <= SIMHASH_DISTANCE
+                    and Path(candidate).exists()):
+                return candidate
+        return None
+    
+    def record_text(self, site, path, digest, simhash, duplicate_of=None):
+        """Remember a page's text signature, re-checking pages that duplicated its old text"""
+        key = str(path)
+        bands = simhash_bands(simhash) if simhash is not None else (None,) * 4
+        with self.lock:
+            row = self.conn.execute("SELECT digest FROM page_texts WHERE path = ?", (key,)).fetchone()
+            if row and row[0] != digest:
+                self.invalidate_duplicates([key])
+            self.conn.execute(
+                "INSERT OR REPLACE INTO page_texts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                # SQLite integers are signed, store the SimHash in two's complement
+                (key, site, digest, simhash - 2 ** 64 if simhash and simhash >= 2 ** 63 else simhash,
+                 *bands, duplicate_of)
+            )
+    
+    def forget_text(self, path):
+        """Drop a page's text signature, re-checking pages that duplicated it"""
+        key = str(path)
+        with self.lock:
+            self.invalidate_duplicates([key])
+            self.conn.execute("DELETE FROM page_texts WHERE path = ?", (key,))
+    
+    def release_duplicates(self):
+        """Re-check pages skipped as duplicates of pages deleted since, before the walk reaches them"""
+        with self.lock:
+            kept = self.conn.execute(
+                "SELECT DISTINCT duplicate_of FROM page_texts WHERE duplicate_of IS NOT NULL"
+            ).fetchall()
+            self.invalidate_duplicates([path for (path,) in kept if not Path(path).exists()])
+            self.conn.commit()
+    
+    def invalidate_duplicates(self, paths):
+        """Force pages skipped as duplicates of these to be parsed again next run"""
+        for path in paths:
+            self.conn.execute(
+                "UPDATE files SET size = -1, sha256 = '' WHERE path IN "
+                "(SELECT path FROM page_texts WHERE duplicate_of = ?)", (path,)
+            )
+            self.conn.execute("DELETE FROM page_texts WHERE duplicate_of = ?", (path,))
+    
+    def record_links(self, path, targets):
+        """Replace the pages a page links to"""
+        key = str(path)
+        with self.lock:
+            self.conn.execute("DELETE FROM page_links WHERE source = ?", (key,))
+            self.conn.executemany(
+                "INSERT INTO page_links VALUES (?, ?)", [(key, str(target)) for target in targets]
+            )
+    
+    def pages(self, index_uid):
+        """Return (rowid, path, doc_ids) for every file of an index, in rowid order"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT rowid, path, doc_ids FROM files WHERE index_uid = ? ORDER BY rowid", (index_uid,)
+            ).fetchall()
+    
+    def links(self, index_uid):
+        """Yield (source rowid, target rowid) for links between files of an index"""
+        # Joined on rowids so millions of links never become path strings in Python.
+        # Links to a page skipped as a duplicate credit the copy that was indexed.
+        with self.lock:
+            yield from self.conn.execute(
+                "SELECT source.rowid, target.rowid FROM page_links "
+                "JOIN files AS source ON source.path = page_links.source "
+                "LEFT JOIN page_texts ON page_texts.path = page_links.target "
+                "JOIN files AS target ON target.path = COALESCE(page_texts.duplicate_of, page_links.target) "
+                "WHERE source.index_uid = ? AND target.index_uid = ?", (index_uid, index_uid)
+            )
+    
+    def rank(self, path):
+        with self.lock:
+            row = self.conn.execute("SELECT rank FROM page_ranks WHERE path = ?", (str(path),)).fetchone()
+        return row[0] if row else None
+    
+    def ranks(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT path, rank FROM page_ranks"))
+    
+    def record_ranks(self, ranks):
+        """Store the ranks of (path, rank) pairs once Meilisearch has them"""
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO page_ranks VALUES (?, ?)", ranks)
+            self.conn.commit()
+    
+    def forget(self, paths):
+        """Drop files from the manifest"""
+        with self.lock:
+            self.invalidate_duplicates(paths)
+            self.conn.executemany(
+                "DELETE FROM files WHERE path = ?", [(path,) for path in paths]
+            )
+            self.conn.executemany(
+                "DELETE FROM page_texts WHERE path = ?", [(path,) for path in paths]
+            )
+            self.conn.executemany(
+                "DELETE FROM page_links WHERE source = ?", [(path,) for path in paths]
+            )
+            self.conn.executemany(
+                "DELETE FROM page_ranks WHERE path = ?", [(path,) for path in paths]
+            )
+    
+    def touch(self, directory):
+        """Mark every file under a directory as seen this run, so a skipped directory is not stale"""
+        prefix = f"{directory}{os.sep}"
+        with self.lock:
+            self.conn.execute(
+                "UPDATE files SET run_id = ? WHERE substr(path, 1, ?) = ?", (self.run_id, len(prefix), prefix)
+            )
+    
+    def archive_progress(self, path):
+        """Return (uuid, next_entry, complete) for a ZIM archive, or None if never indexed"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT uuid, next_entry, complete FROM archives WHERE path = ?", (str(path),)
+            ).fetchone()
+    
+    def save_archive_progress(self, path, uuid, next_entry, complete=False):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?)",
+                (str(path), uuid, next_entry, int(complete))
+            )
+            self.conn.commit()
+    
+    def archives(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT path FROM archives")]
+    
+    def forget_archive(self, path):
+        with self.lock:
+            self.conn.execute("DELETE FROM archives WHERE path = ?", (str(path),))
+            self.conn.commit()
+    
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+class IndexCheckpoints:
+    """Checkpoint files of an indexing run, one per stage and per mirrored site, read back by --resume"""
+    
+    def __init__(self, checkpoint_dir, resume=False):
+        self.dir = Path(checkpoint_dir)
+        self.lock = threading.Lock()
+        if not resume:
+            self.clear()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        # site -> [pages queued, pages settled, walk finished]
+        self.sites = {}
+    
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+    
+    def path(self, stage, site=None):
+        if site is None:
+            return self.dir / f"{stage}.json"
+        return self.dir / stage / f"{site}.json"
+    
+    def load(self, stage, site=None):
+        try:
+            return json.loads(self.path(stage, site).read_text(encoding='utf-8'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def complete(self, stage, site=None):
+        return self.load(stage, site).get('complete', False)
+    
+    def save(self, stage, site=None, **changes):
+        """Update a checkpoint file atomically, so a crash never leaves half of one behind"""
+        with self.lock:
+            state = {**self.load(stage, site), **changes, 'updated_at': time.time()}
+            path = self.path(stage, site)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            tmp_path.write_text(json.dumps(state, indent=2), encoding='utf-8')
+            os.replace(tmp_path, path)
+    
+    def committed(self, stage, paths, site=None):
+        """Record a committed batch of files as the last one of its stage or site"""
+        state = self.load(stage, site)
+        self.save(
+            stage, site, batches=state.get('batches', 0) + 1, files=state.get('files', 0) + len(paths),
+            last_committed=str(paths[-1])
+        )
+    
+    def page_queued(self, site):
+        with self.lock:
+            self.sites.setdefault(site, [0, 0, False])[0] += 1
+    
+    def page_settled(self, site):
+        """Count a page of a site as committed or dead-lettered"""
+        with self.lock:
+            entry = self.sites.setdefault(site, [0, 0, False])
+            entry[1] += 1
+            done = entry[2] and entry[1] >= entry[0]
+        if done:
+            self.save('websites', site, complete=True)
+    
+    def site_walked(self, site):
+        """Note that every page of a site was discovered, completing it once they have all settled"""
+        with self.lock:
+            entry = self.sites.setdefault(site, [0, 0, False])
+            entry[2] = True
+            done = entry[1] >= entry[0]
+        if done:
+            self.save('websites', site, complete=True)
+
+class IndexMetrics:
+    """Per-stage timings, file counts and errors of one indexing run, exported as JSON and Prometheus text"""
+    
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+    
+    def __init__(self, slowest=10):
+        self.lock = threading.Lock()
+        self.slowest = slowest
+        # stage -> {'buckets': [...], 'count', 'sum', 'max', 'slowest': min-heap of (seconds, path)}
+        self.stages = {}
+        # (name, sorted label items) -> value
+        self.values = {}
+        self.errors = {}
+        self.started = time.time()
+        self.finished = None
+        self.succeeded = None
+    
+    def observe(self, stage, seconds, path=None):
+        with self.lock:
+            timing = self.stages.get(stage)
+            if timing is None:
+                timing = self.stages[stage] = {
+                    'buckets': [0] * len(self.BUCKETS), 'count': 0, 'sum': 0.0, 'max': 0.0, 'slowest': []
+                }
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    timing['buckets'][i] += 1
+            timing['count'] += 1
+            timing['sum'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+            if path is not None:
+                entry = (seconds, str(path))
+                if len(timing['slowest']) < self.slowest:
+                    heapq.heappush(timing['slowest'], entry)
+                elif entry > timing['slowest'][0]:
+                    heapq.heapreplace(timing['slowest'], entry)
+    
+    @contextmanager
+    def timer(self, stage, path=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, path)
+    
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+    
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+    
+    def error(self, stage, error):
+        key = (stage, type(error).__name__ if isinstance(error, BaseException) else str(error))
+        with self.lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+    
+    def finish(self, succeeded):
+        self.finished = time.time()
+        self.succeeded = succeeded
+    
+    def summary(self):
+        """JSON-friendly snapshot of the run"""
+        with self.lock:
+            finished = self.finished or time.time()
+            values = {}
+            for (name, labels), value in sorted(self.values.items()):
+                values.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            return {
+                'started_at': self.started,
+                'finished_at': finished,
+                'duration_seconds': finished - self.started,
+                'succeeded': self.succeeded,
+                'stages': {
+                    stage: {
+                        'count': timing['count'],
+                        'seconds': timing['sum'],
+                        'mean_seconds': timing['sum'] / timing['count'],
+                        'max_seconds': timing['max'],
+                        'slowest': [
+                            {'path': path, 'seconds': seconds}
+                            for seconds, path in sorted(timing['slowest'], reverse=True)
+                        ]
+                    }
+                    for stage, timing in self.stages.items()
+                },
+                'values': values,
+                'errors': [
+                    {'stage': stage, 'type': error_type, 'count': count}
+                    for (stage, error_type), count in sorted(self.errors.items())
+                ]
+            }
+    
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format, for node_exporter's textfile collector"""
+        summary = self.summary()
+        lines = [
+            "# HELP archive_indexer_run_seconds Duration of the last indexing run",
+            "# TYPE archive_indexer_run_seconds gauge",
+            f"archive_indexer_run_seconds {summary['duration_seconds']:.3f}",
+            "# HELP archive_indexer_run_success Whether the last indexing run completed",
+            "# TYPE archive_indexer_run_success gauge",
+            f"archive_indexer_run_success {int(bool(summary['succeeded']))}",
+            "# HELP archive_indexer_run_timestamp_seconds When the last indexing run finished",
+            "# TYPE archive_indexer_run_timestamp_seconds gauge",
+            f"archive_indexer_run_timestamp_seconds {summary['finished_at']:.0f}",
+            "# HELP archive_indexer_stage_seconds Time spent per file or batch in each indexing stage",
+            "# TYPE archive_indexer_stage_seconds histogram"
+        ]
+        with self.lock:
+            stages = {stage: dict(timing, buckets=list(timing['buckets'])) for stage, timing in self.stages.items()}
+        for stage, timing in sorted(stages.items()):
+            for bound, count in zip(self.BUCKETS, timing['buckets']):
+                lines.append(f"archive_indexer_stage_seconds_bucket{prometheus_labels(stage=stage, le=bound)} {count}")
+            lines.append(
+                f"archive_indexer_stage_seconds_bucket{prometheus_labels(stage=stage, le='+Inf')} {timing['count']}"
+            )
+            lines.append(f"archive_indexer_stage_seconds_sum{prometheus_labels(stage=stage)} {timing['sum']:.6f}")
+            lines.append(f"archive_indexer_stage_seconds_count{prometheus_labels(stage=stage)} {timing['count']}")
+        
+        for name, samples in summary['values'].items():
+            lines.append(f"# TYPE archive_indexer_{name} gauge")
+            for sample in samples:
+                lines.append(f"archive_indexer_{name}{prometheus_labels(**sample['labels'])} {sample['value']:g}")
+        
+        lines.append("# HELP archive_indexer_errors Errors in the last run by stage and exception type")
+        lines.append("# TYPE archive_indexer_errors gauge")
+        for error in summary['errors']:
+            error_labels = prometheus_labels(stage=error['stage'], type=error['type'])
+            lines.append(f"archive_indexer_errors{error_labels} {error['count']}")
+        return '\n'.join(lines) + '\n'
+    
+    def export(self, json_path=None, prometheus_path=None):
+        """Write the summary and textfile atomically, so collectors never read half a file"""
+        for path, content in ((json_path, lambda: json.dumps(self.summary(), indent=2)),
+                              (prometheus_path, self.prometheus)):
+            if not path:
+                continue
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            tmp_path.write_text(content(), encoding='utf-8')
+            os.replace(tmp_path, path)
+    
+    def report(self):
+        """Print where the time went, stage by stage"""
+        summary = self.summary()
+        print(f"Indexing took {summary['duration_seconds']:.1f}s")
+        for stage, timing in summary['stages'].items():
+            print(f"  {stage}: {timing['count']} in {timing['seconds']:.1f}s "
+                  f"(mean {timing['mean_seconds'] * 1000:.1f} ms, max {timing['max_seconds']:.2f}s)")
+            for slow in timing['slowest'][:3]:
+                print(f"    {slow['seconds']:.2f}s {slow['path']}")
+        for error in summary['errors']:
+            print(f"  {error['count']} {error['type']} errors in {error['stage']}")
+
+class BatchUploader:
+    """Uploads documents in payload-sized batches with a bounded number of Meilisearch tasks in flight"""
+    
+    def __init__(self, client, index_uid, on_commit, max_batch_bytes=5 * 1024 * 1024,
+                 max_in_flight=4, max_retries=3, poll_interval=0.2, metrics=None, on_failure=None, partial=False):
+        self.client = client
+        self.index_uid = index_uid
+        self.on_commit = on_commit
+        self.max_batch_bytes = max_batch_bytes
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+        self.on_failure = on_failure
+        # Partial documents only update the fields they carry
+        self.partial = partial
+        
+        self.lines = []
+        self.line_bytes = 0
+        self.line_tokens = {}
+        self.in_flight = deque()
+        # id(token) -> [token, documents not yet indexed, any batch failed, last documents added]
+        self.outstanding = {}
+        
+        self.batches = 0
+        self.documents = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+    
+    def add(self, docs, token=None, last=True):
+        """Queue documents of a file; its token is committed once the last of them is indexed"""
+        if token is not None:
+            entry = self.outstanding.setdefault(id(token), [token, 0, False, False])
+            entry[1] += len(docs)
+            entry[3] = last
+            if not docs:
+                self.settle(id(token))
+        
+        for doc in docs:
+            # Serialized once here and sent as NDJSON, so batch size is known exactly
+            line = json.dumps(doc, ensure_ascii=False).encode('utf-8')
+            if self.lines and self.line_bytes + len(line) + 1 > self.max_batch_bytes:
+                self.flush()
+            self.lines.append(line)
+            self.line_bytes += len(line) + 1
+            if token is not None:
+                self.line_tokens[id(token)] = self.line_tokens.get(id(token), 0) + 1
+    
+    def take_batch(self):
+        """Return the documents added so far as one batch, or None if there are none"""
+        if not self.lines:
+            return None
+        batch = {
+            'payload': b'\n'.join(self.lines),
+            'count': len(self.lines),
+            'tokens': self.line_tokens,
+            'attempt': 0
+        }
+        self.lines, self.line_bytes, self.line_tokens = [], 0, {}
+        return batch
+    
+    def flush(self):
+        """Enqueue the current batch, waiting first if too many tasks are in flight"""
+        batch = self.take_batch()
+        if batch is None:
+            return
+        
+        while len(self.in_flight) >= self.max_in_flight:
+            self.wait_oldest()
+        self.submit(batch)
+    
+    def submit(self, batch):
+        batch['submitted'] = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                index = self.client.index(self.index_uid)
+                if self.partial:
+                    task = index.update_documents_ndjson(batch['payload'], primary_key='id')
+                else:
+                    task = index.add_documents_ndjson(batch['payload'], primary_key='id')
+                break
+            except MeilisearchError as e:
+                if self.metrics:
+                    self.metrics.error('upload', e)
+                if attempt == self.max_retries:
+                    raise
+                self.backoff(attempt, e)
+        self.in_flight.append((task.task_uid, batch))
+    
+    def retry_delay(self, attempt, error):
+        delay = min(30, 2 ** attempt)
+        print(f"Retrying batch of {self.index_uid} in {delay}s: {error}")
+        return delay
+    
+    def backoff(self, attempt, error):
+        time.sleep(self.retry_delay(attempt, error))
+    
+    def wait_oldest(self):
+        """Poll the oldest task until Meilisearch finishes it, retrying failed batches"""
+        task_uid, batch = self.in_flight.popleft()
+        while True:
+            task = self.client.get_task(task_uid)
+            if task.status in TASK_DONE:
+                break
+            time.sleep(self.poll_interval)
+        
+        if self.metrics and task.status != 'succeeded':
+            self.metrics.error('upload', (task.error or {}).get('code') or task.status)
+        if task.status == 'succeeded':
+            self.finish(batch, True)
+        elif batch['attempt'] < self.max_retries:
+            batch['attempt'] += 1
+            self.backoff(batch['attempt'], task.error)
+            self.submit(batch)
+        else:
+            print(f"Failed to index {batch['count']} documents into {self.index_uid}: {task.error}")
+            self.give_up(batch, task.error)
+    
+    def give_up(self, batch, error):
+        """Settle a batch that kept failing, handing its document ids to on_failure"""
+        if self.on_failure:
+            self.on_failure([json.loads(line)['id'] for line in batch['payload'].split(b'\n')], error)
+        self.finish(batch, False)
+    
+    def discard(self, token):
+        """Never commit a token, for files whose extraction failed part way through"""
+        entry = self.outstanding.get(id(token))
+        if entry:
+            entry[2] = entry[3] = True
+            self.settle(id(token))
+    
+    def settle(self, key):
+        entry = self.outstanding[key]
+        if entry[1] == 0 and entry[3]:
+            del self.outstanding[key]
+            if not entry[2]:
+                self.on_commit([entry[0]])
+    
+    def finish(self, batch, succeeded):
+        for key, count in batch['tokens'].items():
+            entry = self.outstanding[key]
+            entry[1] -= count
+            entry[2] = entry[2] or not succeeded
+            self.settle(key)
+        
+        if succeeded:
+            self.batches += 1
+            self.documents += batch['count']
+            self.bytes += len(batch['payload'])
+            if self.metrics:
+                # Enqueue to completion, including time spent queued behind other tasks
+                self.metrics.observe(
+                    'upload', time.perf_counter() - batch['submitted'], f"{self.index_uid} batch {self.batches}"
+                )
+                self.metrics.count('documents', batch['count'], index=self.index_uid)
+                self.metrics.count('upload_bytes', len(batch['payload']), index=self.index_uid)
+            print(
+                f"{'Updated' if self.partial else 'Indexed'} batch {self.batches} in {self.index_uid} "
+                f"({self.documents} documents so far)"
+            )
+    
+    def abort(self):
+        """Wait for batches Meilisearch already accepted, so their files are committed before a failure propagates"""
+        while self.in_flight:
+            try:
+                self.wait_oldest()
+            except MeilisearchError:
+                return
+    
+    def close(self):
+        """Flush, wait for every task and report throughput"""
+        self.flush()
+        while self.in_flight:
+            self.wait_oldest()
+        self.report()
+    
+    def report(self):
+        if self.documents:
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            megabytes = self.bytes / (1024 * 1024)
+            print(
+                f"{'Updated' if self.partial else 'Indexed'} {self.documents} documents in {self.index_uid} "
+                f"({megabytes:.1f} MB) in {elapsed:.1f}s: "
+                f"{self.documents / elapsed:.0f} docs/sec, {megabytes / elapsed:.2f} MB/sec"
+            )
+            if self.metrics:
+                self.metrics.gauge('documents_per_second', self.documents / elapsed, index=self.index_uid)
+
+class AsyncMeiliError(MeilisearchError):
+    """Failed request of the asyncio client, retried like errors of the synchronous one"""
+
+class AsyncMeiliClient:
+    """The few Meilisearch calls the asyncio mode needs, over a pool of keep-alive connections"""
+    
+    def __init__(self, url, master_key, max_connections=8, timeout=60):
+        self.url = url.rstrip('/')
+        self.master_key = master_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session = None
+    
+    async def __aenter__(self):
+        headers = {'Authorization': f"Bearer {self.master_key}"} if self.master_key else {}
+        self.session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+    
+    async def __aexit__(self, *exc):
+        await self.session.close()
+    
+    async def request(self, method, path, **kwargs):
+        """Send a request, waiting for a free pooled connection rather than opening more"""
+        try:
+            async with self.session.request(method, f"{self.url}{path}", **kwargs) as response:
+                body = await response.json(content_type=None)
+                if response.status >= 400:
+                    message = body.get('message') if isinstance(body, dict) else body
+                    raise AsyncMeiliError(f"{method} {path} returned {response.status}: {message}")
+                return body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise AsyncMeiliError(f"{method} {path} failed: {e!r}") from e
+    
+    async def add_documents_ndjson(self, index_uid, payload):
+        task = await self.request(
+            'POST', f"/indexes/{index_uid}/documents", params={'primaryKey': 'id'}, data=payload,
+            headers={'Content-Type': 'application/x-ndjson'}
+        )
+        return task['taskUid']
+    
+    async def get_task(self, task_uid):
+        return await self.request('GET', f"/tasks/{task_uid}")
+
+class AsyncBatchUploader(BatchUploader):
+    """BatchUploader for the asyncio mode, where batches upload in tasks while extraction carries on"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ready = deque()
+        # Unfinished Meilisearch tasks, bounded so the server is never flooded
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        self.uploads = set()
+        self.failure = None
+    
+    def flush(self):
+        """Hand the current batch to pump(), never blocking the caller"""
+        batch = self.take_batch()
+        if batch is not None:
+            self.ready.append(batch)
+    
+    async def pump(self):
+        """Start uploading ready batches, waiting while max_in_flight of them are unfinished"""
+        while self.ready:
+            await self.slots.acquire()
+            if self.failure:
+                self.slots.release()
+                break
+            upload = asyncio.create_task(self.upload(self.ready.popleft()))
+            self.uploads.add(upload)
+            upload.add_done_callback(self.upload_done)
+        if self.failure:
+            raise self.failure
+    
+    def upload_done(self, upload):
+        self.uploads.discard(upload)
+        self.slots.release()
+        if not upload.cancelled() and upload.exception() and not self.failure:
+            self.failure = upload.exception()
+    
+    async def upload(self, batch):
+        """Enqueue a batch and wait for its task, re-submitting it if the task fails"""
+        while True:
+            batch['submitted'] = time.perf_counter()
+            task = await self.wait_task(await self.enqueue(batch))
+            if task['status'] == 'succeeded':
+                self.finish(batch, True)
+                return
+            
+            error = task.get('error') or {}
+            if self.metrics:
+                self.metrics.error('upload', error.get('code') or task['status'])
+            if batch['attempt'] >= self.max_retries:
+                print(f"Failed to index {batch['count']} documents into {self.index_uid}: {error}")
+                self.give_up(batch, error)
+                return
+            batch['attempt'] += 1
+            await asyncio.sleep(self.retry_delay(batch['attempt'], error))
+    
+    async def enqueue(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.client.add_documents_ndjson(self.index_uid, batch['payload'])
+            except MeilisearchError as e:
+                if self.metrics:
+                    self.metrics.error('upload', e)
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.retry_delay(attempt, e))
+    
+    async def wait_task(self, task_uid):
+        while True:
+            task = await self.client.get_task(task_uid)
+            if task['status'] in TASK_DONE:
+                return task
+            await asyncio.sleep(self.poll_interval)
+    
+    async def aabort(self):
+        """abort() for the asyncio mode"""
+        if self.uploads:
+            await asyncio.wait(set(self.uploads))
+    
+    async def aclose(self):
+        """Flush, wait for every upload and report throughput"""
+        self.flush()
+        await self.pump()
+        if self.uploads:
+            await asyncio.wait(set(self.uploads))
+        if self.failure:
+            raise self.failure
+        self.report()
+
 class ArchiveIndexer:
-    def __init__(self, meili_url, master_key):
+    def __init__(self, meili_url, master_key, state_dir="/state", pdf_workers=None, pdf_timeout=120,
+                 pdf_pages_per_task=25, html_extractor='lxml', web_read_workers=4, web_parse_workers=0,
+                 web_dedup='near', upload_batch_bytes=5 * 1024 * 1024, upload_max_in_flight=4, ready_timeout=120,
+                 metrics_file=None, prometheus_file=None, pdf_collections=None, web_max_page_bytes=10 * 1024 * 1024,
+                 index_mode='threads', meili_max_connections=8, resume=False):
         self.client = Client(meili_url, master_key)
+        self.meili_url = meili_url
+        self.master_key = master_key
         self.data_dir = Path("/data")
         self.zim_dir = Path("/zims")
+        self.manifest = IndexManifest(Path(state_dir) / "manifest.sqlite3")
+        # Without --resume a run starts with fresh checkpoints and an empty dead-letter file
+        self.checkpoints = IndexCheckpoints(Path(state_dir) / "checkpoints", resume)
+        self.dead_letter_file = Path(state_dir) / "dead_letter.jsonl"
+        self.dead_letter_lock = threading.Lock()
+        # Bumped after every run, the search gateway drops its cached results when it changes
+        self.generation_file = Path(state_dir) / "search_generation"
+        if not resume:
+            self.dead_letter_file.unlink(missing_ok=True)
+        self.pdf_workers = pdf_workers or os.cpu_count()
+        self.pdf_collections = load_pdf_collections(pdf_collections, pdf_pages_per_task, pdf_timeout)
+        self.queue_size = 400
+        self.upload_batch_bytes = upload_batch_bytes
+        self.upload_max_in_flight = upload_max_in_flight
+        self.html_extractor = get_html_extractor(html_extractor)
+        # Zero parse workers keeps the single-threaded website pipeline
+        self.web_read_workers = web_read_workers
+        self.web_parse_workers = web_parse_workers
+        self.web_dedup = web_dedup
+        self.web_max_page_bytes = web_max_page_bytes
+        self.ready_timeout = ready_timeout
+        self.metrics = IndexMetrics()
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        if index_mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode '{index_mode}', expected one of {', '.join(INDEX_MODES)}")
+        if index_mode == 'async' and aiohttp is None:
+            print("aiohttp is not installed, falling back to the threaded indexer")
+            index_mode = 'threads'
+        self.index_mode = index_mode
+        self.meili_max_connections = meili_max_connections
         
+    def wait_until_ready(self):
+        """Poll the health endpoint with exponential backoff until Meilisearch is available"""
+        deadline = time.monotonic() + self.ready_timeout
+        delay = 0.1
+        while True:
+            try:
+                if self.client.health().get('status') == 'available':
+                    return
+            except MeilisearchError as e:
+                error = e
+            else:
+                error = "server not available yet"
+            
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Meilisearch not ready after {self.ready_timeout}s: {error}")
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+    
     def create_indices(self):
-        """Create search indices for different content types"""
-        
-        # Create index for PDFs and documents
-        self.client.create_index('documents', {
-            'primaryKey': 'id',
-            'searchableAttributes': ['title', 'content', 'category'],
-            'filterableAttributes': ['category', 'source'],
-            'sortableAttributes': ['title']
-        })
+        """Create search indices for different content types, only sending settings that changed"""
+        for index_uid, settings in INDEX_SETTINGS.items():
+            try:
+                current = self.client.index(index_uid).get_settings()
+            except MeilisearchApiError as e:
+                if e.code != 'index_not_found':
+                    raise
+                self.client.create_index(index_uid, {'primaryKey': 'id'})
+                current = {}
+            
+            if settings_match(current, settings):
+                print(f"Search index {index_uid} is up to date")
+                continue
+            
+            # Tasks run in order, so documents enqueued after this see the new settings
+            self.client.index(index_uid).update_settings(settings)
+            print(f"Updated settings for search index {index_uid}")
+    
+    def queue_pdf_files(self):
+        """Return a heap of the first page windows of new or changed PDFs, and their file count per priority"""
+        # Windows of pages waiting for a worker, ordered by (priority, file, first page)
+        pending = []
+        files_left = {}
+        for collection in self.pdf_collections:
+            collection_dir = self.data_dir / collection['directory']
+            if not collection_dir.exists():
+                continue
+            for pdf_file in sorted(collection_dir.glob(collection['glob'])):
+                fingerprint = self.check_file(pdf_file, 'documents')
+                if fingerprint is None:
+                    continue
+                state = {
+                    'collection': collection,
+                    'pdf_file': pdf_file,
+                    'token': (pdf_file, [], fingerprint),
+                    'order': (-collection['priority'], len(pending)),
+                    'windows_left': None
+                }
+                heapq.heappush(pending, (state['order'], 0, state))
+                files_left[collection['priority']] = files_left.get(collection['priority'], 0) + 1
+        return pending, files_left
+    
+    def next_pdf_window(self, pending):
+        """Pop the next window to extract as (state, first_page, page_count), skipping files that failed"""
+        while pending:
+            _, first_page, state = heapq.heappop(pending)
+            if state['windows_left'] == -1:
+                continue
+            collection = state['collection']
+            page_count = collection['pages_per_task']
+            if collection['max_pages']:
+                page_count = min(page_count, collection['max_pages'] - first_page)
+            return state, first_page, page_count
+        return None
+    
+    def pdf_window_done(self, state, future, uploader, pending, files_left):
+        """Queue the pages of an extracted window, scheduling the rest of its file after the first one"""
+        collection, pdf_file, token = state['collection'], state['pdf_file'], state['token']
+        category = collection['category']
         
-        # Create index for mirrored websites
-        self.client.create_index('websites', {
-            'primaryKey': 'id',
-            'searchableAttributes': ['title', 'content', 'url', 'site_name'],
-            'filterableAttributes': ['site_name'],
-            'sortableAttributes': ['title']
-        })
+        def file_done():
+            # Send a priority's last documents right away instead of waiting for a full batch
+            files_left[collection['priority']] -= 1
+            if files_left[collection['priority']] == 0:
+                uploader.flush()
         
-        print("Created search indices")
+        try:
+            (total_pages, pages), seconds = future.result()
+        except Exception as e:
+            if state['windows_left'] != -1:
+                self.record_failure('documents', pdf_file, 'extract', e)
+                uploader.discard(token)
+                file_done()
+            state['windows_left'] = -1
+            return
+        if state['windows_left'] == -1:
+            return
+        self.metrics.observe('extract', seconds, pdf_file)
+        
+        # The first window tells us how many more to schedule
+        if state['windows_left'] is None:
+            last_page = total_pages
+            if collection['max_pages']:
+                last_page = min(last_page, collection['max_pages'])
+            remaining = range(collection['pages_per_task'], last_page, collection['pages_per_task'])
+            state['windows_left'] = len(remaining)
+            for first_page in remaining:
+                heapq.heappush(pending, (state['order'], first_page, state))
+        else:
+            state['windows_left'] -= 1
+        
+        docs = [
+            {
+                'id': pdf_page_doc_id(category, pdf_file, number),
+                'title': pdf_file.stem.replace('_', ' ').title(),
+                'content': text,
+                'category': category,
+                'source': pdf_file.name,
+                'page': number,
+                'file_path': str(pdf_file)
+            }
+            for number, text in pages if text.strip()
+        ]
+        token[1].extend(doc['id'] for doc in docs)
+        uploader.add(docs, token, last=state['windows_left'] == 0)
+        if state['windows_left'] == 0:
+            print(f"Extracted {category} PDF: {pdf_file.name} ({total_pages} pages)")
+            file_done()
     
     def index_pdfs(self):
-        """Index PDF documents"""
-        documents = []
+        """Index new or changed PDF documents of every collection, highest priority first"""
+        self.manifest.ensure_format('documents', INDEX_FORMATS['documents'])
+        uploader = self.uploader('documents')
+        pending, files_left = self.queue_pdf_files()
         
-        # Index survival PDFs
-        survival_dir = self.data_dir / "survival"
-        if survival_dir.exists():
-            for pdf_file in survival_dir.glob("*.pdf"):
-                try:
-                    with pdfplumber.open(pdf_file) as pdf:
-                        content = ""
-                        for page in pdf.pages[:10]:  # First 10 pages
-                            content += page.extract_text() or ""
-                    
-                    doc = {
-                        'id': f"survival_{pdf_file.stem}",
-                        'title': pdf_file.stem.replace('_', ' ').title(),
-                        'content': content[:5000],  # Limit content length
-                        'category': 'survival',
-                        'source': pdf_file.name,
-                        'file_path': str(pdf_file)
-                    }
-                    documents.append(doc)
-                    print(f"Indexed survival PDF: {pdf_file.name}")
-                except Exception as e:
-                    print(f"Error indexing {pdf_file}: {e}")
+        # Extract windows in a shared pool, one document per page. Only a few windows are
+        # handed to the pool at a time, so lower priority files cannot queue ahead of the rest
+        try:
+            with ProcessPoolExecutor(max_workers=self.pdf_workers) as pool:
+                futures = {}
+                
+                def submit_pending():
+                    while len(futures) < self.pdf_workers * 2 and (window := self.next_pdf_window(pending)):
+                        state, first_page, page_count = window
+                        future = pool.submit(
+                            timed_call, extract_pdf_pages, str(state['pdf_file']), first_page, page_count,
+                            state['collection']['timeout']
+                        )
+                        futures[future] = state
+                
+                submit_pending()
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.pdf_window_done(futures.pop(future), future, uploader, pending, files_left)
+                    submit_pending()
+            
+            uploader.close()
+        except Exception:
+            uploader.abort()
+            raise
+        self.remove_stale('documents')
+    
+    async def index_pdfs_async(self, client):
+        """index_pdfs for the asyncio mode, uploading finished pages while later windows are extracted"""
+        self.manifest.ensure_format('documents', INDEX_FORMATS['documents'])
+        uploader = self.async_uploader(client, 'documents')
+        pending, files_left = self.queue_pdf_files()
+        loop = asyncio.get_running_loop()
         
-        # Index medical PDFs
-        medical_dir = self.data_dir / "medical"
-        if medical_dir.exists():
-            for pdf_file in medical_dir.glob("*.pdf"):
-                try:
-                    with pdfplumber.open(pdf_file) as pdf:
-                        content = ""
-                        for page in pdf.pages[:10]:
-                            content += page.extract_text() or ""
-                    
-                    doc = {
-                        'id': f"medical_{pdf_file.stem}",
-                        'title': pdf_file.stem.replace('_', ' ').title(),
-                        'content': content[:5000],
-                        'category': 'medical',
-                        'source': pdf_file.name,
-                        'file_path': str(pdf_file)
-                    }
-                    documents.append(doc)
-                    print(f"Indexed medical PDF: {pdf_file.name}")
-                except Exception as e:
-                    print(f"Error indexing {pdf_file}: {e}")
+        try:
+            with ProcessPoolExecutor(max_workers=self.pdf_workers) as pool:
+                futures = {}
+                
+                def submit_pending():
+                    while len(futures) < self.pdf_workers * 2 and (window := self.next_pdf_window(pending)):
+                        state, first_page, page_count = window
+                        future = loop.run_in_executor(
+                            pool, timed_call, extract_pdf_pages, str(state['pdf_file']), first_page, page_count,
+                            state['collection']['timeout']
+                        )
+                        futures[future] = state
+                
+                submit_pending()
+                while futures:
+                    done, _ = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+                    for future in done:
+                        self.pdf_window_done(futures.pop(future), future, uploader, pending, files_left)
+                    submit_pending()
+                    await uploader.pump()
+            
+            await uploader.aclose()
+        except Exception:
+            await uploader.aabort()
+            raise
+        self.remove_stale('documents')
+    
+    def website_dirs(self, mirrored_dir):
+        """Yield site directories in sorted order, leaving out sites finished by the run being resumed"""
+        for site_dir in sorted(mirrored_dir.iterdir()):
+            if not site_dir.is_dir():
+                continue
+            if self.checkpoints.complete('websites', site_dir.name):
+                # Its pages stay indexed, they are just not walked again
+                self.manifest.touch(site_dir)
+                print(f"Skipping website {site_dir.name}, finished by the interrupted run")
+                continue
+            yield site_dir
+    
+    def discover_pages(self, mirrored_dir):
+        """Yield (site_name, html_file, fingerprint) for new or changed pages"""
+        for site_dir in self.website_dirs(mirrored_dir):
+            site_name = site_dir.name
+            print(f"Indexing website: {site_name}")
+            
+            # Find HTML files
+            for html_file in iter_html_files(site_dir):
+                fingerprint = self.check_file(html_file, 'websites')
+                if fingerprint is not None:
+                    yield site_name, html_file, fingerprint
+            self.checkpoints.site_walked(site_name)
+    
+    def discover_site(self, site_dir, site_queue, stop):
+        """Fill one site's work queue with its new or changed pages"""
+        try:
+            for html_file in iter_html_files(site_dir):
+                fingerprint = self.check_file(html_file, 'websites')
+                if fingerprint is not None:
+                    if not put_unless_stopped(site_queue, (site_dir.name, html_file, fingerprint), stop):
+                        return
+            self.checkpoints.site_walked(site_dir.name)
+        except Exception as e:
+            put_unless_stopped(site_queue, PipelineError(e), stop)
+            raise
+        finally:
+            put_unless_stopped(site_queue, None, stop)
+    
+    def discover_pages_concurrently(self, mirrored_dir, discover_pool, stop):
+        """Discover all sites in parallel, yielding pages site by site in sorted order"""
+        site_queues = []
+        for site_dir in self.website_dirs(mirrored_dir):
+            site_queue = queue.Queue(maxsize=self.queue_size // 4)
+            walking = discover_pool.submit(self.discover_site, site_dir, site_queue, stop)
+            site_queues.append((site_dir.name, site_queue, walking))
         
-        # Index gardening PDFs
-        gardening_dir = self.data_dir / "gardening"
-        if gardening_dir.exists():
-            for pdf_file in gardening_dir.glob("*.pdf"):
+        for site_name, site_queue, walking in site_queues:
+            print(f"Indexing website: {site_name}")
+            while (item := site_queue.get()) is not None:
+                if isinstance(item, PipelineError):
+                    raise item.error
+                yield item
+            # A half-walked site must fail the stage, or its unwalked pages would look stale
+            walking.result()
+    
+    def parse_pages_concurrently(self, mirrored_dir, stop):
+        """Yield (doc, signature, links, html_file, fingerprint) in discovery order, overlapping reads and parsing"""
+        discover_pool = ThreadPoolExecutor(max_workers=self.web_read_workers)
+        read_pool = ThreadPoolExecutor(max_workers=self.web_read_workers)
+        # Threads are already running, so fork-free workers avoid inheriting held locks
+        parse_pool = ProcessPoolExecutor(
+            max_workers=self.web_parse_workers, mp_context=multiprocessing.get_context('forkserver')
+        )
+        
+        def read_then_parse(site_name, html_file):
+            with self.metrics.timer('read', html_file):
+                content = read_page(html_file, self.web_max_page_bytes)
+            if isinstance(content, mmap.mmap):
+                content.close()
+                content = None
+            return parse_pool.submit(
+                timed_call, build_page_document, content, html_file, mirrored_dir, site_name, self.html_extractor
+            )
+        
+        def resolve(entry):
+            site_name, html_file, fingerprint, reading = entry
+            stage = 'read'
+            try:
+                parsing = reading.result()
+                stage = 'parse'
+                (doc, signature, links), seconds = parsing.result()
+            except SkippedPage as e:
+                return None, e.reason, None, html_file, fingerprint
+            except Exception as e:
+                self.record_failure('websites', html_file, stage, e)
+                return None
+            self.metrics.observe('parse', seconds, html_file)
+            return doc, signature, links, html_file, fingerprint
+        
+        # A window of in-flight pages, drained from the front to keep output order stable
+        in_flight = deque()
+        # Separate from stop, so a failed walk can still hand its error to the consumer
+        stop_walking = threading.Event()
+        try:
+            for site_name, html_file, fingerprint in self.discover_pages_concurrently(
+                mirrored_dir, discover_pool, stop_walking
+            ):
+                if stop.is_set():
+                    return
+                reading = read_pool.submit(read_then_parse, site_name, html_file)
+                in_flight.append((site_name, html_file, fingerprint, reading))
+                if len(in_flight) >= self.queue_size:
+                    result = resolve(in_flight.popleft())
+                    if result:
+                        yield result
+            while in_flight:
+                result = resolve(in_flight.popleft())
+                if result:
+                    yield result
+        finally:
+            stop_walking.set()
+            for pool in (discover_pool, read_pool, parse_pool):
+                pool.shutdown(cancel_futures=True)
+    
+    def produce_pages(self, mirrored_dir, pages, stop):
+        """Parse discovered pages into the bounded queue until done or stopped"""
+        try:
+            if self.web_parse_workers:
+                for item in self.parse_pages_concurrently(mirrored_dir, stop):
+                    if not put_unless_stopped(pages, item, stop):
+                        return
+                return
+            
+            for site_name, html_file, fingerprint in self.discover_pages(mirrored_dir):
+                if stop.is_set():
+                    return
+                stage = 'read'
                 try:
-                    with pdfplumber.open(pdf_file) as pdf:
-                        content = ""
-                        for page in pdf.pages[:10]:
-                            content += page.extract_text() or ""
-                    
-                    doc = {
-                        'id': f"gardening_{pdf_file.stem}",
-                        'title': pdf_file.stem.replace('_', ' ').title(),
-                        'content': content[:5000],
-                        'category': 'gardening',
-                        'source': pdf_file.name,
-                        'file_path': str(pdf_file)
-                    }
-                    documents.append(doc)
-                    print(f"Indexed gardening PDF: {pdf_file.name}")
+                    with self.metrics.timer('read', html_file):
+                        content = read_page(html_file, self.web_max_page_bytes)
+                    stage = 'parse'
+                    with self.metrics.timer('parse', html_file):
+                        doc, signature, links = build_page_document(
+                            content, html_file, mirrored_dir, site_name, self.html_extractor
+                        )
+                except SkippedPage as e:
+                    item = (None, e.reason, None, html_file, fingerprint)
                 except Exception as e:
-                    print(f"Error indexing {pdf_file}: {e}")
-        
-        if documents:
-            self.client.index('documents').add_documents(documents)
-            print(f"Indexed {len(documents)} PDF documents")
+                    self.record_failure('websites', html_file, stage, e)
+                    continue
+                else:
+                    item = (doc, signature, links, html_file, fingerprint)
+                if not put_unless_stopped(pages, item, stop):
+                    return
+        except Exception as e:
+            # A failed walk must fail the stage, or unwalked pages would look stale
+            put_unless_stopped(pages, PipelineError(e), stop)
+        finally:
+            put_unless_stopped(pages, None, stop)
     
     def index_websites(self):
-        """Index mirrored websites"""
-        websites = []
+        """Index new or changed pages of mirrored websites"""
+        self.manifest.ensure_format('websites', INDEX_FORMATS['websites'])
+        self.manifest.release_duplicates()
         mirrored_dir = self.data_dir / "mirrored_sites"
         
         if not mirrored_dir.exists():
             print("No mirrored websites found")
             return
         
-        for site_dir in mirrored_dir.iterdir():
-            if site_dir.is_dir():
-                site_name = site_dir.name
-                print(f"Indexing website: {site_name}")
-                
-                # Find HTML files
-                for html_file in site_dir.rglob("*.html"):
-                    try:
-                        with open(html_file, 'r', encoding='utf-8', errors='ignore') as f:
-                            content = f.read()
-                        
-                        soup = BeautifulSoup(content, 'html.parser')
-                        
-                        # Extract text content
-                        text_content = soup.get_text(strip=True)
-                        title = soup.title.string if soup.title else html_file.stem
-                        
-                        # Get relative URL
-                        rel_path = html_file.relative_to(mirrored_dir)
-                        url = f"/{rel_path}"
-                        
-                        doc = {
-                            'id': f"site_{site_name}_{html_file.stem}",
-                            'title': title,
-                            'content': text_content[:3000],  # Limit content
-                            'url': url,
-                            'site_name': site_name,
-                            'file_path': str(html_file)
-                        }
-                        websites.append(doc)
-                        
-                    except Exception as e:
-                        print(f"Error indexing {html_file}: {e}")
-        
-        if websites:
-            # Add in batches to avoid timeouts
-            batch_size = 100
-            for i in range(0, len(websites), batch_size):
-                batch = websites[i:i+batch_size]
-                self.client.index('websites').add_documents(batch)
-                print(f"Indexed batch {i//batch_size + 1}/{(len(websites)-1)//batch_size + 1}")
+        # Parse in a background thread, bounded so memory stays flat on large mirrors
+        pages = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self.produce_pages, args=(mirrored_dir, pages, stop), daemon=True
+        )
+        producer.start()
+        
+        uploader = self.uploader('websites')
+        skipped = {}
+        try:
+            while (item := pages.get()) is not None:
+                if isinstance(item, PipelineError):
+                    raise item.error
+                self.add_page(uploader, item, skipped)
+            uploader.close()
+        except Exception:
+            uploader.abort()
+            raise
+        finally:
+            # Unblock the producer if uploading failed part way through
+            stop.set()
+            producer.join()
+        
+        self.finish_websites(skipped)
+    
+    def add_page(self, uploader, item, skipped):
+        """Queue a parsed page for upload, counting skipped and duplicate pages by reason"""
+        doc, signature, links, html_file, fingerprint = item
+        mirrored_dir = self.data_dir / "mirrored_sites"
+        self.manifest.record_links(html_file, [mirrored_dir / link for link in links or []])
+        if doc is None:
+            # Skipped files carry the reason instead of a signature, and are recorded
+            # with no documents so they are not sniffed again until they change
+            skipped[signature] = skipped.get(signature, 0) + 1
+            uploader.add([], (html_file, [], fingerprint))
+            return
+        # Re-uploading replaces the whole document, so it keeps its rank until rank_pages() updates it
+        rank = self.manifest.rank(html_file)
+        if rank is not None:
+            doc['rank'] = rank
+        duplicate_of = self.find_duplicate_page(doc['site_name'], html_file, signature)
+        if duplicate_of:
+            # Recorded with no documents, so an earlier copy of it gets deleted
+            skipped['duplicate'] = skipped.get('duplicate', 0) + 1
+            uploader.add([], (html_file, [], fingerprint))
+        else:
+            uploader.add([doc], (html_file, [doc['id']], fingerprint))
+    
+    def finish_websites(self, skipped):
+        duplicates = skipped.pop('duplicate', 0)
+        if duplicates:
+            print(f"Skipped {duplicates} duplicate web pages")
+            self.metrics.count('files', duplicates, index='websites', result='duplicate')
+        for reason, count in sorted(skipped.items()):
+            print(f"Skipped {count} web pages: {reason.replace('_', ' ')}")
+            self.metrics.count('skipped_files', count, index='websites', reason=reason)
+        self.remove_stale('websites')
+        self.rank_pages()
+    
+    def rank_pages(self):
+        """Score every mirrored page by the links pointing at it and send ranks that changed"""
+        if sparse is None:
+            print("NumPy or SciPy is not installed, web pages are not ranked")
+            return
+        with self.metrics.timer('rank'):
+            pages = self.manifest.pages('websites')
+            if not pages:
+                return
+            # Links come back as manifest rowids, positions in the sorted rowids number the pages
+            rowids = np.fromiter((rowid for rowid, _, _ in pages), np.int64, len(pages))
+            edges = np.fromiter(self.manifest.links('websites'), np.dtype((np.int64, 2))).reshape(-1, 2)
+            ranks = page_rank(
+                np.searchsorted(rowids, edges[:, 0]), np.searchsorted(rowids, edges[:, 1]), len(pages)
+            )
             
-            print(f"Indexed {len(websites)} web pages")
+            # Three significant digits, so small shifts elsewhere in the graph do not resend every page
+            stored = self.manifest.ranks()
+            uploader = BatchUploader(
+                self.client, 'websites', self.manifest.record_ranks, self.upload_batch_bytes,
+                self.upload_max_in_flight, partial=True,
+                on_failure=lambda doc_ids, error: self.dead_letter('websites', 'rank', error, doc_ids=doc_ids)
+            )
+            changed = 0
+            for (_, path, doc_ids), rank in zip(pages, ranks.tolist()):
+                rank = float(f"{rank:.3g}")
+                doc_ids = json.loads(doc_ids)
+                if doc_ids and stored.get(path) != rank:
+                    uploader.add([{'id': doc_id, 'rank': rank} for doc_id in doc_ids], (path, rank))
+                    changed += 1
+            uploader.close()
+        print(f"Ranked {len(pages)} web pages by {len(edges)} links, {changed} ranks changed")
+        self.metrics.gauge('links', len(edges), index='websites')
+        self.metrics.count('ranks_changed', changed, index='websites')
+    
+    async def load_page(self, read_pool, parse_pool, site_name, html_file, mirrored_dir):
+        """Check, read and parse one page in executors, returning a pipeline item or None"""
+        loop = asyncio.get_running_loop()
+        fingerprint = await loop.run_in_executor(read_pool, self.check_file, html_file, 'websites')
+        if fingerprint is None:
+            return None
+        
+        stage = 'read'
+        try:
+            content, seconds = await loop.run_in_executor(
+                read_pool, timed_call, read_page, html_file, self.web_max_page_bytes
+            )
+            self.metrics.observe('read', seconds, html_file)
+            stage = 'parse'
+            if parse_pool is None:
+                parse_pool = read_pool
+            elif isinstance(content, mmap.mmap):
+                # Mapped pages are not sent to parse workers, they map the file again instead
+                content.close()
+                content = None
+            (doc, signature, links), seconds = await loop.run_in_executor(
+                parse_pool, timed_call, build_page_document, content, html_file, mirrored_dir, site_name,
+                self.html_extractor
+            )
+            self.metrics.observe('parse', seconds, html_file)
+        except SkippedPage as e:
+            return None, e.reason, None, html_file, fingerprint
+        except Exception as e:
+            self.record_failure('websites', html_file, stage, e)
+            return None
+        return doc, signature, links, html_file, fingerprint
+    
+    async def index_websites_async(self, client):
+        """index_websites for the asyncio mode, with reads and parsing in executors and uploads in tasks"""
+        self.manifest.ensure_format('websites', INDEX_FORMATS['websites'])
+        self.manifest.release_duplicates()
+        mirrored_dir = self.data_dir / "mirrored_sites"
+        
+        if not mirrored_dir.exists():
+            print("No mirrored websites found")
+            return
+        
+        read_pool = ThreadPoolExecutor(max_workers=self.web_read_workers)
+        parse_pool = None
+        if self.web_parse_workers:
+            parse_pool = ProcessPoolExecutor(
+                max_workers=self.web_parse_workers, mp_context=multiprocessing.get_context('forkserver')
+            )
+        uploader = self.async_uploader(client, 'websites')
+        skipped = {}
+        # A window of pages being loaded, drained from the front to keep upload order stable.
+        # Site names mark where a site's pages end, since pages are checked inside load_page
+        in_flight = deque()
+        
+        async def add_oldest():
+            loading = in_flight.popleft()
+            if isinstance(loading, str):
+                self.checkpoints.site_walked(loading)
+                return
+            item = await loading
+            if item:
+                self.add_page(uploader, item, skipped)
+            await uploader.pump()
+        
+        try:
+            for site_dir in self.website_dirs(mirrored_dir):
+                print(f"Indexing website: {site_dir.name}")
+                for html_file in iter_html_files(site_dir):
+                    in_flight.append(asyncio.ensure_future(
+                        self.load_page(read_pool, parse_pool, site_dir.name, html_file, mirrored_dir)
+                    ))
+                    if len(in_flight) >= self.queue_size:
+                        await add_oldest()
+                in_flight.append(site_dir.name)
+            while in_flight:
+                await add_oldest()
+            await uploader.aclose()
+        except Exception:
+            await uploader.aabort()
+            raise
+        finally:
+            for loading in in_flight:
+                if not isinstance(loading, str):
+                    loading.cancel()
+            for pool in (read_pool, parse_pool):
+                if pool:
+                    pool.shutdown(cancel_futures=True)
+        
+        self.finish_websites(skipped)
+    
+    async def index_async(self, stages=('pdfs', 'websites')):
+        """Run indexing stages in asyncio mode, sharing one pool of connections to Meilisearch"""
+        async with AsyncMeiliClient(self.meili_url, self.master_key, self.meili_max_connections) as client:
+            for stage in stages:
+                await getattr(self, f"index_{stage}_async")(client)
+    
+    def find_duplicate_page(self, site_name, html_file, signature):
+        """Return the page this one duplicates, recording its text signature either way"""
+        if self.web_dedup == 'off':
+            return None
+        digest, simhash = signature
+        if digest is None:
+            self.manifest.forget_text(html_file)
+            return None
+        if self.web_dedup == 'exact':
+            simhash = None
+        duplicate_of = self.manifest.find_duplicate(site_name, html_file, digest, simhash)
+        self.manifest.record_text(site_name, html_file, digest, simhash, duplicate_of)
+        return duplicate_of
+    
+    def index_zims(self):
+        """Stream HTML articles out of every ZIM archive, resuming where the last run stopped"""
+        if Archive is None:
+            print("python-libzim is not installed, skipping ZIM archives")
+            return
+        if not self.zim_dir.exists():
+            print("No ZIM archives found")
+            return
+        
+        zim_files = sorted(self.zim_dir.glob("*.zim"))
+        
+        # Drop articles of archives that were removed
+        present = {str(zim_file) for zim_file in zim_files}
+        for path in self.manifest.archives():
+            if path not in present:
+                self.delete_zim_articles(Path(path).stem)
+                self.manifest.forget_archive(path)
+        
+        for zim_file in zim_files:
+            try:
+                self.index_zim(zim_file)
+            except Exception as e:
+                self.record_failure('zim_articles', zim_file, 'read', e)
+    
+    def index_zim(self, zim_file):
+        archive = Archive(zim_file)
+        # python-libzim has no public way to walk every entry in order, only this underscored
+        # accessor; fail the archive clearly should a release drop it
+        get_entry_by_id = getattr(archive, '_get_entry_by_id', None)
+        if get_entry_by_id is None:
+            raise RuntimeError("this python-libzim cannot read entries by id, install a release that can")
+        uuid = str(archive.uuid)
+        book = zim_file.stem
+        
+        progress = self.manifest.archive_progress(zim_file)
+        if progress and progress[0] == uuid:
+            if progress[2]:
+                return
+            first_entry = progress[1]
+            print(f"Resuming ZIM archive {zim_file.name} at entry {first_entry}/{archive.entry_count}")
+        else:
+            # New or replaced archive, its old articles have different entry ids
+            if progress:
+                self.delete_zim_articles(book)
+            first_entry = 0
+            print(f"Indexing ZIM archive {zim_file.name} ({archive.entry_count} entries)")
+        
+        # Checkpoints only advance past chunks whose documents are all indexed, in order
+        chunk_ends = deque()
+        committed = set()
+        
+        def on_commit(tokens):
+            committed.update(token[0] for token in tokens)
+            while chunk_ends and chunk_ends[0] in committed:
+                self.manifest.save_archive_progress(zim_file, uuid, chunk_ends.popleft())
+        
+        uploader = BatchUploader(
+            self.client, 'zim_articles', on_commit, self.upload_batch_bytes, self.upload_max_in_flight,
+            metrics=self.metrics,
+            on_failure=lambda doc_ids, error: self.dead_letter('zim_articles', 'upload', error, doc_ids=doc_ids)
+        )
+        slug = re.sub(r'[^A-Za-z0-9_-]', '_', book)
+        try:
+            self.index_zim_chunks(zim_file, archive, get_entry_by_id, first_entry, slug, uploader, chunk_ends)
+            uploader.close()
+        except Exception:
+            uploader.abort()
+            raise
+        
+        if not chunk_ends:
+            self.manifest.save_archive_progress(zim_file, uuid, archive.entry_count, complete=True)
+            print(f"Indexed ZIM archive {zim_file.name}")
+        else:
+            print(f"ZIM archive {zim_file.name} had articles that failed, the next run resumes at the first of them")
+    
+    def index_zim_chunks(self, zim_file, archive, get_entry_by_id, first_entry, slug, uploader, chunk_ends):
+        """Queue the articles of an archive chunk by chunk, each chunk ending in a checkpoint token"""
+        book = zim_file.stem
+        for chunk_start in range(first_entry, archive.entry_count, ZIM_CHECKPOINT_ENTRIES):
+            chunk_end = min(chunk_start + ZIM_CHECKPOINT_ENTRIES, archive.entry_count)
+            docs = []
+            failures = 0
+            for entry_id in range(chunk_start, chunk_end):
+                entry = get_entry_by_id(entry_id)
+                if entry.is_redirect:
+                    continue
+                item = entry.get_item()
+                if not item.mimetype.startswith('text/html'):
+                    continue
+                article = f"{zim_file.name}/{entry.path}"
+                try:
+                    with self.metrics.timer('read', article):
+                        content = bytes(item.content)
+                    with self.metrics.timer('parse', article):
+                        title, description, text_content, _ = self.html_extractor.extract(content)
+                except Exception as e:
+                    self.record_failure('zim_articles', article, 'parse', e)
+                    failures += 1
+                    error = e
+                    continue
+                docs.append({
+                    'id': f"zim_{slug}_{entry_id}",
+                    'title': entry.title or ' '.join((title or entry.path).split()),
+                    'content': ' '.join(text_content.split())[:3000],  # Limit content
+                    'url': f"/kiwix/content/{book}/{entry.path}",
+                    'zim': book
+                })
+            if failures and not docs:
+                # Nothing parses, most likely a bug rather than bad articles, so stop before
+                # walking the rest of the archive and leave the checkpoint where it is
+                raise RuntimeError(f"no article of entries {chunk_start}-{chunk_end} could be parsed: {error}")
+            token = (chunk_end,)
+            chunk_ends.append(chunk_end)
+            uploader.add(docs, token)
+            if failures:
+                # Never committed, so the checkpoint stays before this chunk and it is retried next run
+                uploader.discard(token)
+    
+    def delete_zim_articles(self, book):
+        self.client.index('zim_articles').delete_documents(filter=f"zim = '{book}'")
+        print(f"Removed articles of ZIM archive {book}")
+    
+    def uploader(self, index_uid):
+        """Batch uploader that records files in the manifest once their documents are indexed"""
+        return BatchUploader(
+            self.client, index_uid, lambda pending: self.commit_manifest(index_uid, pending),
+            self.upload_batch_bytes, self.upload_max_in_flight, metrics=self.metrics,
+            on_failure=lambda doc_ids, error: self.dead_letter(index_uid, 'upload', error, doc_ids=doc_ids)
+        )
+    
+    def async_uploader(self, client, index_uid):
+        """uploader() for the asyncio mode"""
+        return AsyncBatchUploader(
+            client, index_uid, lambda pending: self.commit_manifest(index_uid, pending),
+            self.upload_batch_bytes, self.upload_max_in_flight, metrics=self.metrics,
+            on_failure=lambda doc_ids, error: self.dead_letter(index_uid, 'upload', error, doc_ids=doc_ids)
+        )
+    
+    def check_file(self, path, index_uid):
+        """Fingerprint a file against the manifest, timing and counting the result"""
+        with self.metrics.timer('discover', path):
+            fingerprint = self.manifest.check(path)
+        self.metrics.count('files', index=index_uid, result='unchanged' if fingerprint is None else 'changed')
+        if fingerprint is not None and index_uid == 'websites':
+            self.checkpoints.page_queued(self.site_of(path))
+        return fingerprint
+    
+    def site_of(self, html_file):
+        return Path(html_file).relative_to(self.data_dir / "mirrored_sites").parts[0]
+    
+    def record_failure(self, index_uid, path, stage, error):
+        print(f"Error indexing {path}: {error}")
+        self.metrics.error(stage, error)
+        self.metrics.count('files', index=index_uid, result='failed')
+        self.dead_letter(index_uid, stage, error, path=path)
+        if index_uid == 'websites':
+            # Dead-lettered pages do not hold up their site's checkpoint, a plain run retries them
+            self.checkpoints.page_settled(self.site_of(path))
+    
+    def dead_letter(self, index_uid, stage, error, path=None, doc_ids=None):
+        """Append a file or batch of documents that could not be indexed to the dead-letter file"""
+        entry = {'time': time.time(), 'index': index_uid, 'stage': stage, 'error': str(error)}
+        if path is not None:
+            entry['path'] = str(path)
+        if doc_ids is not None:
+            entry['doc_ids'] = doc_ids
+        with self.dead_letter_lock:
+            self.dead_letter_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.dead_letter_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    
+    def commit_manifest(self, index_uid, pending):
+        """Record uploaded files and delete documents they no longer produce"""
+        obsolete = []
+        for path, doc_ids, fingerprint in pending:
+            obsolete.extend(self.manifest.record(path, index_uid, doc_ids, fingerprint))
+        self.metrics.count('files', len(pending), index=index_uid, result='indexed')
+        
+        if obsolete:
+            self.client.index(index_uid).delete_documents(obsolete)
+        
+        self.manifest.commit()
+        
+        # Checkpoints only ever point at files whose manifest rows are durable
+        if index_uid != 'websites':
+            self.checkpoints.committed(STAGE_OF_INDEX[index_uid], [path for path, _, _ in pending])
+            return
+        by_site = {}
+        for path, _, _ in pending:
+            by_site.setdefault(self.site_of(path), []).append(path)
+        for site, paths in by_site.items():
+            self.checkpoints.committed('websites', paths, site)
+            for _ in paths:
+                self.checkpoints.page_settled(site)
+    
+    def remove_stale(self, index_uid):
+        """Delete documents for files that disappeared since the last run"""
+        stale = self.manifest.stale(index_uid)
+        obsolete = [doc_id for path, doc_ids in stale for doc_id in doc_ids]
+        
+        if obsolete:
+            self.client.index(index_uid).delete_documents(obsolete)
+            print(f"Removed {len(obsolete)} stale documents from {index_uid}")
+        
+        self.manifest.forget([path for path, doc_ids in stale])
+        self.manifest.commit()
+    
+    def index_stage(self, stage):
+        """Run one of INDEX_STAGES in the configured mode"""
+        # libzim reads are synchronous and already checkpointed, so ZIMs always use threads
+        if self.index_mode == 'async' and stage != 'zims':
+            asyncio.run(self.index_async([stage]))
+        else:
+            getattr(self, f"index_{stage}")()
+    
+    def bump_generation(self):
+        """Count finished runs in the file the search gateway watches"""
+        try:
+            generation = int(self.generation_file.read_text()) + 1
+        except (OSError, ValueError):
+            generation = 1
+        tmp_file = self.generation_file.with_name(f".{self.generation_file.name}.tmp")
+        tmp_file.write_text(str(generation))
+        os.replace(tmp_file, self.generation_file)
+        print(f"Search generation is now {generation}")
     
     def run_indexing(self):
         """Run complete indexing process"""
         print("Starting archive indexing...")
         
-        # Wait for Meilisearch to be ready
-        time.sleep(10)
-        
+        succeeded = False
         try:
+            # Start as soon as Meilisearch is ready
+            self.wait_until_ready()
             self.create_indices()
-            self.index_pdfs()
-            self.index_websites()
-            print("Indexing completed successfully!")
+            
+            failed = []
+            for stage in INDEX_STAGES:
+                if self.checkpoints.complete(stage):
+                    print(f"Skipping {stage}, finished by the interrupted run")
+                    continue
+                try:
+                    self.index_stage(stage)
+                except Exception as e:
+                    # Later stages still run, and --resume continues this one from its checkpoints
+                    print(f"Indexing {stage} failed: {e}")
+                    self.metrics.error(stage, e)
+                    self.dead_letter(stage, 'run', e)
+                    failed.append(stage)
+                    continue
+                self.checkpoints.save(stage, complete=True)
+            
+            # Even a partly failed run changed documents that cached searches may hold
+            self.bump_generation()
+            if failed:
+                print(f"Indexing failed for {', '.join(failed)}, rerun with --resume to continue")
+            else:
+                # Nothing left to resume
+                self.checkpoints.clear()
+                print("Indexing completed successfully!")
+                succeeded = True
         except Exception as e:
             print(f"Indexing failed: {e}")
+            self.metrics.error('run', e)
+        finally:
+            self.metrics.finish(succeeded)
+            self.metrics.report()
+            try:
+                self.metrics.export(self.metrics_file, self.prometheus_file)
+            except OSError as e:
+                print(f"Could not write indexing metrics: {e}")
 
 if __name__ == "__main__":
+    import sys
+    
+    # --resume continues the stages and sites an interrupted run left unfinished
+    resume = "--resume" in sys.argv[1:]
     meili_url = os.getenv("MEILI_URL", "http://meilisearch:7700")
     master_key = os.getenv("MEILI_MASTER_KEY")
+    state_dir = os.getenv("INDEX_STATE_DIR", "/state")
+    pdf_workers = int(os.getenv("PDF_WORKERS", "0")) or None
+    pdf_timeout = int(os.getenv("PDF_TIMEOUT", "120"))
+    pdf_pages_per_task = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+    html_extractor = os.getenv("HTML_EXTRACTOR", "lxml")
+    web_read_workers = int(os.getenv("WEB_READ_WORKERS", "4"))
+    web_parse_workers = int(os.getenv("WEB_PARSE_WORKERS", "0"))
+    web_dedup = os.getenv("WEB_DEDUP", "near")
+    upload_batch_bytes = int(os.getenv("UPLOAD_BATCH_BYTES", str(5 * 1024 * 1024)))
+    upload_max_in_flight = int(os.getenv("UPLOAD_MAX_IN_FLIGHT", "4"))
+    ready_timeout = int(os.getenv("MEILI_READY_TIMEOUT", "120"))
+    metrics_file = os.getenv("METRICS_FILE", f"{state_dir}/indexer_metrics.json")
+    prometheus_file = os.getenv("PROMETHEUS_TEXTFILE")
+    pdf_collections = os.getenv("PDF_COLLECTIONS", "/app/pdf_collections.toml")
+    web_max_page_bytes = int(os.getenv("WEB_MAX_PAGE_BYTES", str(10 * 1024 * 1024)))
+    index_mode = os.getenv("INDEX_MODE", "threads")
+    meili_max_connections = int(os.getenv("MEILI_MAX_CONNECTIONS", "8"))
     
     if not master_key:
         print("MEILI_MASTER_KEY environment variable required")
         exit(1)
     
-    indexer = ArchiveIndexer(meili_url, master_key)
+    indexer = ArchiveIndexer(
+        meili_url, master_key, state_dir, pdf_workers, pdf_timeout, pdf_pages_per_task, html_extractor,
+        web_read_workers, web_parse_workers, web_dedup, upload_batch_bytes, upload_max_in_flight, ready_timeout,
+        metrics_file, prometheus_file, pdf_collections, web_max_page_bytes, index_mode, meili_max_connections,
+        resume
+    )
     indexer.run_indexing()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Minimal in-process stand-in for the parts of the Meilisearch HTTP API the indexer uses.
+"""
+
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+def now():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+class MeiliStub:
+    """Meilisearch stub that accepts documents and completes every task immediately"""
+
+    def __init__(self, host='127.0.0.1', port=0, task_delay=0.0):
+        self.indexes = {}
+        self.tasks = {}
+        self.task_delay = task_delay
+        self.requests = 0
+        self.received_bytes = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def index(self, uid):
+        with self.lock:
+            return self.indexes.setdefault(uid, {'documents': {}, 'settings': {}})
+
+    def document_count(self, uid):
+        return len(self.indexes.get(uid, {}).get('documents', {}))
+
+    def enqueue(self, index_uid, task_type):
+        with self.lock:
+            uid = len(self.tasks) + 1
+            self.tasks[uid] = {
+                'uid': uid,
+                'indexUid': index_uid,
+                'status': 'enqueued',
+                'type': task_type,
+                'enqueuedAt': now(),
+                'readyAt': time.monotonic() + self.task_delay
+            }
+        return {
+            'taskUid': uid,
+            'indexUid': index_uid,
+            'status': 'enqueued',
+            'type': task_type,
+            'enqueuedAt': now()
+        }
+
+    def task(self, uid):
+        task = dict(self.tasks[uid])
+        if time.monotonic() >= task.pop('readyAt'):
+            task.update(status='succeeded', finishedAt=now())
+        return task
+
+    def stats(self):
+        """Global stats, with the size of the stored documents as JSON standing in for the database size"""
+        with self.lock:
+            return {
+                'databaseSize': sum(len(json.dumps(doc)) for index in self.indexes.values()
+                                    for doc in index['documents'].values()),
+                'lastUpdate': now(),
+                'indexes': {
+                    uid: {'numberOfDocuments': len(index['documents']), 'isIndexing': False, 'fieldDistribution': {}}
+                    for uid, index in self.indexes.items()
+                }
+            }
+
+    def documents(self, uid, offset=0, limit=20, fields=None):
+        """One page of documents, limited to the requested fields"""
+        documents = list(self.indexes[uid]['documents'].values())
+        page = documents[offset:offset + limit]
+        if fields and fields != ['*']:
+            page = [{field: doc[field] for field in fields if field in doc} for doc in page]
+        return {'results': page, 'offset': offset, 'limit': limit, 'total': len(documents)}
+
+    def search(self, uid, query):
+        """Naive substring search over searchable attributes"""
+        index = self.indexes.get(uid)
+        if index is None:
+            return None
+        started = time.perf_counter()
+        terms = (query.get('q') or '').lower().split()
+        attributes = index['settings'].get('searchableAttributes') or ['*']
+        limit = query.get('limit', 20)
+        offset = query.get('offset', 0)
+
+        hits = []
+        for doc in index['documents'].values():
+            fields = doc.values() if attributes == ['*'] else (doc.get(a, '') for a in attributes)
+            text = ' '.join(str(value) for value in fields).lower()
+            if all(term in text for term in terms):
+                hits.append(doc)
+        return {
+            'hits': hits[offset:offset + limit],
+            'query': query.get('q') or '',
+            'processingTimeMs': int((time.perf_counter() - started) * 1000),
+            'limit': limit,
+            'offset': offset,
+            'estimatedTotalHits': len(hits)
+        }
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are separate writes, Nagle would stall keep-alive clients on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status, body):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def not_found(self, code='index_not_found'):
+                self.reply(404, {'message': f"{self.path} not found", 'code': code,
+                                 'type': 'invalid_request', 'link': ''})
+
+            def body(self):
+                raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with stub.lock:
+                    stub.requests += 1
+                    stub.received_bytes += len(raw)
+                return raw
+
+            def do_GET(self):
+                self.body()
+                path = self.path.split('?')[0]
+                if path == '/health':
+                    return self.reply(200, {'status': 'available'})
+                if path == '/stats':
+                    return self.reply(200, stub.stats())
+                if match := re.fullmatch(r'/tasks/(\d+)', path):
+                    if int(match.group(1)) not in stub.tasks:
+                        return self.not_found('task_not_found')
+                    return self.reply(200, stub.task(int(match.group(1))))
+                if match := re.fullmatch(r'/indexes/([^/]+)/settings', path):
+                    if match.group(1) not in stub.indexes:
+                        return self.not_found()
+                    return self.reply(200, stub.indexes[match.group(1)]['settings'])
+                if match := re.fullmatch(r'/indexes/([^/]+)/documents', path):
+                    if match.group(1) not in stub.indexes:
+                        return self.not_found()
+                    params = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+                    return self.reply(200, stub.documents(
+                        match.group(1), int(params.get('offset', 0)), int(params.get('limit', 20)),
+                        params['fields'].split(',') if 'fields' in params else None
+                    ))
+                if match := re.fullmatch(r'/indexes/([^/]+)', path):
+                    if match.group(1) not in stub.indexes:
+                        return self.not_found()
+                    return self.reply(200, {'uid': match.group(1), 'primaryKey': 'id',
+                                            'createdAt': now(), 'updatedAt': now()})
+                self.not_found('not_found')
+
+            def do_PATCH(self):
+                settings = json.loads(self.body() or b'{}')
+                if match := re.fullmatch(r'/indexes/([^/]+)/settings', self.path):
+                    stub.index(match.group(1))['settings'].update(settings)
+                    return self.reply(202, stub.enqueue(match.group(1), 'settingsUpdate'))
+                self.not_found('not_found')
+
+            def do_PUT(self):
+                raw = self.body()
+                path = self.path.split('?')[0]
+                if match := re.fullmatch(r'/indexes/([^/]+)/documents', path):
+                    if 'ndjson' in (self.headers.get('Content-Type') or ''):
+                        docs = [json.loads(line) for line in raw.splitlines() if line.strip()]
+                    else:
+                        docs = json.loads(raw)
+                    documents = stub.index(match.group(1))['documents']
+                    with stub.lock:
+                        # Partial updates merge into existing documents
+                        for doc in docs:
+                            documents.setdefault(doc['id'], {}).update(doc)
+                    return self.reply(202, stub.enqueue(match.group(1), 'documentAdditionOrUpdate'))
+                self.not_found('not_found')
+
+            def do_POST(self):
+                raw = self.body()
+                path = self.path.split('?')[0]
+                if path == '/indexes':
+                    uid = json.loads(raw)['uid']
+                    stub.index(uid)
+                    return self.reply(202, stub.enqueue(uid, 'indexCreation'))
+                if match := re.fullmatch(r'/indexes/([^/]+)/documents', path):
+                    if 'ndjson' in (self.headers.get('Content-Type') or ''):
+                        docs = [json.loads(line) for line in raw.splitlines() if line.strip()]
+                    else:
+                        docs = json.loads(raw)
+                    documents = stub.index(match.group(1))['documents']
+                    with stub.lock:
+                        for doc in docs:
+                            documents[doc['id']] = doc
+                    return self.reply(202, stub.enqueue(match.group(1), 'documentAdditionOrUpdate'))
+                if match := re.fullmatch(r'/indexes/([^/]+)/documents/fetch', path):
+                    if match.group(1) not in stub.indexes:
+                        return self.not_found()
+                    params = json.loads(raw or b'{}')
+                    return self.reply(200, stub.documents(
+                        match.group(1), params.get('offset', 0), params.get('limit', 20), params.get('fields')
+                    ))
+                if match := re.fullmatch(r'/indexes/([^/]+)/documents/delete-batch', path):
+                    documents = stub.index(match.group(1))['documents']
+                    with stub.lock:
+                        for doc_id in json.loads(raw):
+                            documents.pop(doc_id, None)
+                    return self.reply(202, stub.enqueue(match.group(1), 'documentDeletion'))
+                if match := re.fullmatch(r'/indexes/([^/]+)/documents/delete', path):
+                    # Only the "field = 'value'" filters the indexer sends
+                    field, value = re.fullmatch(r"(\w+) = '(.*)'", json.loads(raw)['filter']).groups()
+                    documents = stub.index(match.group(1))['documents']
+                    with stub.lock:
+                        for doc_id in [k for k, doc in documents.items() if str(doc.get(field)) == value]:
+                            del documents[doc_id]
+                    return self.reply(202, stub.enqueue(match.group(1), 'documentDeletion'))
+                if match := re.fullmatch(r'/indexes/([^/]+)/search', path):
+                    result = stub.search(match.group(1), json.loads(raw or b'{}'))
+                    if result is None:
+                        return self.not_found()
+                    return self.reply(200, result)
+                self.not_found('not_found')
+
+        return Handler
+
+if __name__ == "__main__":
+    import sys
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 7700
+    stub = MeiliStub(port=port)
+    print(f"Meilisearch stub listening on {stub.url}")
+    stub.server.serve_forever()
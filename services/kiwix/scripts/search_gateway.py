@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Caching search gateway in front of Meilisearch for the archive.
+
+Results are cached by normalized query and filters until they expire or the indexer
+finishes a run, identical searches in flight at the same time share one upstream
+request, and /search queries the documents and websites indices at once.
+"""
+
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
+
+# The only indices the gateway serves, everything else in Meilisearch stays private
+SEARCH_INDEXES = ['documents', 'websites', 'zim_articles']
+# Queried together by /search unless the request names its own
+MERGED_INDEXES = ['documents', 'websites']
+# Search parameters passed on to Meilisearch, anything else in a request is ignored
+FORWARDED_PARAMS = {
+    'q', 'filter', 'limit', 'offset', 'sort', 'attributesToRetrieve', 'attributesToCrop', 'cropLength',
+    'attributesToHighlight', 'highlightPreTag', 'highlightPostTag', 'matchingStrategy', 'showRankingScore'
+}
+# Query-string values are text, these are converted the way Meilisearch's own GET search route does
+LIST_PARAMS = {'sort', 'attributesToRetrieve', 'attributesToCrop', 'attributesToHighlight'}
+INT_PARAMS = {'cropLength'}
+BOOL_PARAMS = {'showRankingScore'}
+MAX_LIMIT = 100
+# Merged searches fetch offset + limit hits from every index, so deep pages are capped too
+MAX_OFFSET = 900
+# The generation file is re-read at most this often, so a finished run is noticed within a second
+GENERATION_CHECK_INTERVAL = 1.0
+
+class UpstreamError(Exception):
+    """Meilisearch rejected a search or could not be reached"""
+
+    def __init__(self, status, body):
+        super().__init__(status, body)
+        self.status = status
+        self.body = body
+
+class SearchCache:
+    """LRU cache of search results that expire after a TTL or when the index generation changes"""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (expires, result), least recently used first
+        self.entries = OrderedDict()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, result, generation):
+        """Store a result, unless the index changed while it was being fetched"""
+        if generation != self.generation or not self.max_entries:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def set_generation(self, generation):
+        """Drop every entry once the indexer has finished another run"""
+        if generation != self.generation:
+            self.entries.clear()
+            self.generation = generation
+
+    def stats(self):
+        return {
+            'entries': len(self.entries), 'max_entries': self.max_entries, 'ttl': self.ttl,
+            'generation': self.generation, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions
+        }
+
+def json_error(error_class, message, code):
+    """An HTTP error with a Meilisearch-style JSON body"""
+    return error_class(text=json.dumps({'message': message, 'code': code}), content_type='application/json')
+
+def normalize_query(params):
+    """Return the forwarded search parameters, normalized so equivalent searches share a cache key"""
+    query = {key: value for key, value in params.items() if key in FORWARDED_PARAMS}
+    # Meilisearch ignores case and repeated whitespace in queries
+    query['q'] = ' '.join(str(query.get('q') or '').lower().split())
+    if isinstance(query.get('filter'), str):
+        query['filter'] = ' '.join(query['filter'].split())
+    if not query.get('filter'):
+        query.pop('filter', None)
+    try:
+        query['limit'] = min(max(int(query.get('limit', 20)), 0), MAX_LIMIT)
+        query['offset'] = min(max(int(query.get('offset', 0)), 0), MAX_OFFSET)
+    except (TypeError, ValueError):
+        raise json_error(web.HTTPBadRequest, "limit and offset must be integers", 'invalid_search_params')
+    return query
+
+def query_string_params(query):
+    """Search parameters of a GET request, typed as Meilisearch expects them in a JSON body"""
+    params = dict(query)
+    for key, value in params.items():
+        if key in LIST_PARAMS:
+            params[key] = [item.strip() for item in value.split(',') if item.strip()]
+        elif key in INT_PARAMS:
+            try:
+                params[key] = int(value)
+            except ValueError:
+                raise json_error(web.HTTPBadRequest, f"{key} must be an integer", 'invalid_search_params')
+        elif key in BOOL_PARAMS:
+            if value.lower() not in ('true', 'false'):
+                raise json_error(web.HTTPBadRequest, f"{key} must be true or false", 'invalid_search_params')
+            params[key] = value.lower() == 'true'
+    return params
+
+def cache_key(*parts):
+    return json.dumps(parts, sort_keys=True, separators=(',', ':'))
+
+class SearchGateway:
+    """Serves cached, coalesced searches from a pool of keep-alive connections to Meilisearch"""
+
+    def __init__(self, meili_url, api_key, generation_file, cache_size=1024, cache_ttl=300,
+                 max_connections=16, timeout=10):
+        self.meili_url = meili_url.rstrip('/')
+        self.api_key = api_key
+        self.generation_file = Path(generation_file)
+        self.generation_checked = float('-inf')
+        self.cache = SearchCache(cache_size, cache_ttl)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session = None
+        # (generation, key) -> task fetching that result
+        self.in_flight = {}
+        self.coalesced = 0
+        self.upstream_requests = 0
+
+    async def start(self, app):
+        headers = {'Authorization': f"Bearer {self.api_key}"} if self.api_key else {}
+        self.session = ClientSession(
+            headers=headers,
+            connector=TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+            timeout=ClientTimeout(total=self.timeout)
+        )
+
+    async def stop(self, app):
+        await self.session.close()
+
+    def current_generation(self):
+        """Return the indexer's run counter, clearing the cache when it has moved on"""
+        now = time.monotonic()
+        if now - self.generation_checked >= GENERATION_CHECK_INTERVAL:
+            self.generation_checked = now
+            try:
+                generation = int(self.generation_file.read_text())
+            except (OSError, ValueError):
+                generation = 0
+            self.cache.set_generation(generation)
+        return self.cache.generation
+
+    async def cached(self, key, fetch):
+        """Return (result, 'hit' | 'miss' | 'coalesced'), fetching at most once per key at a time"""
+        generation = self.current_generation()
+        result = self.cache.get(key)
+        if result is not None:
+            return result, 'hit'
+
+        # Keyed by generation too, so a search after a run never joins one started before it
+        flight_key = (generation, key)
+        task = self.in_flight.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self.in_flight[flight_key] = task
+            task.add_done_callback(lambda done: self.fetched(flight_key, done))
+            state = 'miss'
+        else:
+            self.coalesced += 1
+            state = 'coalesced'
+        # Shielded, so one visitor closing the connection does not cancel the search for the others
+        return await asyncio.shield(task), state
+
+    def fetched(self, flight_key, task):
+        del self.in_flight[flight_key]
+        # Failed searches are not cached, the next request tries again
+        if not task.cancelled() and task.exception() is None:
+            generation, key = flight_key
+            self.cache.put(key, task.result(), generation)
+
+    async def search_index(self, index_uid, query):
+        self.upstream_requests += 1
+        try:
+            async with self.session.post(f"{self.meili_url}/indexes/{index_uid}/search", json=query) as response:
+                body = await response.json(content_type=None)
+                if response.status >= 400:
+                    raise UpstreamError(response.status, body)
+                return body
+        except (ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError(502, {'message': f"Meilisearch unavailable: {e!r}", 'code': 'gateway_upstream'})
+
+    async def merged_search(self, query, indexes):
+        """Search several indices at once and merge their hits by ranking score"""
+        # Every index has to supply hits up to the end of the requested page
+        window = dict(query, offset=0, limit=query['offset'] + query['limit'], showRankingScore=True)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.search_index(index_uid, window) for index_uid in indexes))
+
+        hits = []
+        for index_uid, result in zip(indexes, results):
+            for hit in result['hits']:
+                hit['_index'] = index_uid
+                hits.append(hit)
+        # Each index returns its hits in order, a stable sort only interleaves them
+        hits.sort(key=lambda hit: hit.get('_rankingScore', 0), reverse=True)
+        return {
+            'hits': hits[query['offset']:query['offset'] + query['limit']],
+            'query': query['q'],
+            'limit': query['limit'],
+            'offset': query['offset'],
+            'estimatedTotalHits': sum(result.get('estimatedTotalHits', 0) for result in results),
+            'indexes': {
+                index_uid: result.get('estimatedTotalHits', 0) for index_uid, result in zip(indexes, results)
+            },
+            'processingTimeMs': int((time.perf_counter() - started) * 1000)
+        }
+
+    async def request_params(self, request):
+        if request.method == 'POST':
+            try:
+                params = await request.json()
+            except ValueError:
+                params = None
+            if not isinstance(params, dict):
+                raise json_error(web.HTTPBadRequest, "Request body must be a JSON object", 'bad_request')
+            return params
+        params = query_string_params(request.query)
+        if 'index' in request.query:
+            params['indexes'] = request.query.getall('index')
+        return params
+
+    def respond(self, result, state):
+        return web.json_response(result, headers={'X-Cache': state})
+
+    async def handle_search(self, request):
+        """GET or POST /search: one query over the documents and websites indices"""
+        params = await self.request_params(request)
+        indexes = params.get('indexes') or MERGED_INDEXES
+        if isinstance(indexes, str):
+            indexes = indexes.split(',')
+        unknown = set(indexes) - set(SEARCH_INDEXES)
+        if unknown:
+            raise json_error(web.HTTPNotFound, f"Unknown index {', '.join(sorted(unknown))}", 'index_not_found')
+        indexes = sorted(set(indexes))
+        query = normalize_query(params)
+        try:
+            result, state = await self.cached(
+                cache_key('merged', indexes, query), lambda: self.merged_search(query, indexes)
+            )
+        except UpstreamError as e:
+            return web.json_response(e.body, status=e.status)
+        return self.respond(result, state)
+
+    async def handle_index_search(self, request):
+        """GET or POST /indexes/{index}/search, the Meilisearch search route with caching"""
+        index_uid = request.match_info['index']
+        if index_uid not in SEARCH_INDEXES:
+            raise json_error(web.HTTPNotFound, f"Unknown index {index_uid}", 'index_not_found')
+        query = normalize_query(await self.request_params(request))
+        try:
+            result, state = await self.cached(
+                cache_key('index', index_uid, query), lambda: self.search_index(index_uid, query)
+            )
+        except UpstreamError as e:
+            return web.json_response(e.body, status=e.status)
+        return self.respond(result, state)
+
+    async def handle_health(self, request):
+        return web.json_response({'status': 'available'})
+
+    async def handle_stats(self, request):
+        self.current_generation()
+        return web.json_response(dict(
+            self.cache.stats(), in_flight=len(self.in_flight), coalesced=self.coalesced,
+            upstream_requests=self.upstream_requests
+        ))
+
+    async def handle_preflight(self, request):
+        return web.Response()
+
+    def app(self):
+        @web.middleware
+        async def allow_any_origin(request, handler):
+            # The archive pages search from the browser on another host
+            response = await handler(request)
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+            return response
+
+        app = web.Application(middlewares=[allow_any_origin])
+        for method in ('GET', 'POST'):
+            app.router.add_route(method, '/search', self.handle_search)
+            app.router.add_route(method, '/indexes/{index}/search', self.handle_index_search)
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_get('/stats', self.handle_stats)
+        app.router.add_route('OPTIONS', '/{path:.*}', self.handle_preflight)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        return app
+
+if __name__ == "__main__":
+    meili_url = os.getenv("MEILI_URL", "http://meilisearch:7700")
+    # A search-only key is enough, the master key is used if none is configured
+    api_key = os.getenv("MEILI_SEARCH_KEY") or os.getenv("MEILI_MASTER_KEY")
+    state_dir = os.getenv("INDEX_STATE_DIR", "/state")
+    generation_file = os.getenv("SEARCH_GENERATION_FILE", f"{state_dir}/search_generation")
+    cache_size = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+    cache_ttl = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+    max_connections = int(os.getenv("MEILI_MAX_CONNECTIONS", "16"))
+    port = int(os.getenv("GATEWAY_PORT", "8080"))
+
+    gateway = SearchGateway(meili_url, api_key, generation_file, cache_size, cache_ttl, max_connections)
+    web.run_app(gateway.app(), port=port)